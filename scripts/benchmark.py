@@ -0,0 +1,144 @@
+# Scaling benchmark of the preprocessing engine on synthetic cohorts. Freezes of increasing
+# size are generated once, each cohort is then preprocessed in a fresh process with a cold
+# and a warm columnar cache, and the processed outputs are compared with a reference run so
+# that changes to the engine can be shown not to change any result
+import argparse
+import json
+import os
+import platform
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+
+from cohorts import COHORTS
+from ingest import CACHE_DIR
+from preprocess import preprocess_cohort
+from synthetic import write_cohort
+
+SIZES = (1000, 10000, 100000, 1000000)
+OUTPUTS = ('structural_features.csv', 'clinical.csv', 'baseline.csv', 'inclusion_funnel.csv')
+
+
+def generate(spec, data_root, n_subjects, n_rois, max_visits, missing, seed):
+    spec = spec.with_data_root(data_root)
+    if not (os.path.exists(spec.baseline_path) and os.path.exists(spec.long_path)):
+        start = time.perf_counter()
+        write_cohort(spec, data_root, n_subjects, n_rois, max_visits, missing, seed)
+        print(f'  generated {spec.name} with {n_subjects} subjects in {time.perf_counter() - start:.1f} s')
+    return spec
+
+
+# Preprocess a cohort in a new interpreter so that neither imports nor memory of previous
+# runs are counted, and return the stage report with the wall time seen from outside
+def timed_run(spec, **options):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        _, report = executor.submit(preprocess_cohort, spec, **options).result()
+    report['wall_seconds'] = round(time.perf_counter() - start, 4)
+    report['peak_rss_mb'] = max(stage['peak_rss_mb'] for stage in report['stages'])
+    return report
+
+
+# Differences between the processed outputs of a run and those of a reference run
+def compare_outputs(output_dir, reference_dir, rtol=1e-5):
+    if not os.path.isdir(reference_dir):
+        return [f'no reference in {reference_dir}']
+    differences = []
+    for name in OUTPUTS:
+        df_reference = pd.read_csv(os.path.join(reference_dir, name))
+        df = pd.read_csv(os.path.join(output_dir, name))
+        try:
+            pd.testing.assert_frame_equal(df, df_reference, check_exact=False, rtol=rtol)
+        except AssertionError as error:
+            differences.append(f'{name}: {" ".join(str(error).split())}')
+    with open(os.path.join(output_dir, 'icv_coefficients.json')) as f:
+        slopes = pd.Series(json.load(f)['slopes'])
+    with open(os.path.join(reference_dir, 'icv_coefficients.json')) as f:
+        reference_slopes = pd.Series(json.load(f)['slopes'])
+    try:
+        pd.testing.assert_series_equal(slopes, reference_slopes, check_exact=False, rtol=rtol)
+    except AssertionError as error:
+        differences.append(f'icv_coefficients.json: {" ".join(str(error).split())}')
+    return differences
+
+
+def save_reference(output_dir, reference_dir):
+    os.makedirs(reference_dir, exist_ok=True)
+    for name in (*OUTPUTS, 'icv_coefficients.json'):
+        shutil.copy(os.path.join(output_dir, name), reference_dir)
+
+
+def benchmark_cohort(spec, repeats=1, reference=None, save_to=None, **options):
+    # Cold run from the source CSVs without cache or previous outputs
+    shutil.rmtree(os.path.join(spec.directory, CACHE_DIR), ignore_errors=True)
+    shutil.rmtree(spec.output_dir, ignore_errors=True)
+    runs = [dict(timed_run(spec, **options), cache_state='cold')]
+    runs += [dict(timed_run(spec, **options), cache_state='warm') for _ in range(repeats)]
+
+    result = {'cohort': spec.name, 'runs': runs}
+    if save_to is not None:
+        save_reference(spec.output_dir, save_to)
+    if reference is not None:
+        result['differences'] = compare_outputs(spec.output_dir, reference)
+        result['matches_reference'] = not result['differences']
+    return result
+
+
+def summary(results):
+    lines = [f'{"subjects":>10} {"cohort":<7}{"cache":<7}{"wall (s)":>10}{"engine (s)":>12}'
+             f'{"peak RSS (MB)":>15}{"included":>10}  reference']
+    for size in results['sizes']:
+        for result in size['cohorts']:
+            check = {True: 'match', False: 'DIFFERENT', None: ''}[result.get('matches_reference')]
+            for run in result['runs']:
+                included = run['funnel'][-1]['remaining'] if run['funnel'] else ''
+                lines.append(f'{size["subjects"]:>10} {result["cohort"]:<7}{run["cache_state"]:<7}'
+                             f'{run["wall_seconds"]:>10.2f}{run["total_seconds"]:>12.2f}'
+                             f'{run["peak_rss_mb"]:>15.1f}{included:>10}  {check}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing on synthetic cohorts of increasing size')
+    parser.add_argument('workdir', help='Folder for the synthetic freezes, the outputs and the results')
+    parser.add_argument('cohorts', nargs='*', metavar='COHORT', help='Cohorts to benchmark (default: all)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='Number of subjects per cohort')
+    parser.add_argument('--rois', type=int, default=34, help='Number of cortical regions per hemisphere')
+    parser.add_argument('--visits', type=int, default=8, help='Maximum number of PACC visits per subject')
+    parser.add_argument('--missing', type=float, default=0.05, help='Fraction of missing values')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic freezes')
+    parser.add_argument('--repeats', type=int, default=1, help='Number of warm cache runs after the cold one')
+    parser.add_argument('--reference', default=None, help='Folder with the outputs of a reference run to compare with')
+    parser.add_argument('--save-reference', default=None, help='Folder where the outputs are kept as a reference')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='Run the engine without the cache')
+    parser.add_argument('--memory-map', action='store_true', help='Memory-map the cached files when reading')
+    parser.add_argument('--cache-format', choices=['parquet', 'feather'], default='parquet')
+    parser.add_argument('--long-chunksize', type=int, default=None, help='Stream the long format files in chunks')
+    parser.add_argument('--output', default=None, help='Results file (default: <workdir>/benchmark.json)')
+    args = parser.parse_args()
+    unknown = set(args.cohorts) - set(COHORTS)
+    if unknown:
+        raise SystemExit(f'Unknown cohorts: {", ".join(sorted(unknown))}')
+
+    options = {'cache': args.cache, 'memory_map': args.memory_map, 'fmt': args.cache_format,
+               'long_chunksize': args.long_chunksize}
+    results = {'platform': platform.platform(), 'cpus': os.cpu_count(), 'pandas': pd.__version__,
+               'options': options, 'sizes': []}
+    for size in args.sizes:
+        print(f'{size} subjects')
+        data_root = os.path.join(args.workdir, f'n{size}')
+        cohort_results = []
+        for name in args.cohorts or COHORTS:
+            seed = args.seed + list(COHORTS).index(name)
+            spec = generate(COHORTS[name], data_root, size, args.rois, args.visits, args.missing, seed)
+            reference = os.path.join(args.reference, f'n{size}', name) if args.reference else None
+            save_to = os.path.join(args.save_reference, f'n{size}', name) if args.save_reference else None
+            cohort_results.append(benchmark_cohort(spec, args.repeats, reference, save_to, **options))
+        results['sizes'].append({'subjects': size, 'rois': args.rois, 'visits': args.visits, 'cohorts': cohort_results})
+
+    with open(args.output or os.path.join(args.workdir, 'benchmark.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    print(summary(results))
@@ -0,0 +1,189 @@
+# BrainAge modelling of the processed structural features. A linear model of age is trained
+# on the CN (e4- and AB-) participants of a cohort with k-fold cross-validation, corrected for
+# the age bias of its out-of-fold predictions and applied to every participant. CN participants
+# keep their out-of-fold predictions so that their deltas are held out like those of the rest.
+# The fold fits are solved together from the sufficient statistics of each fold, and the fitted
+# model is saved so that new scans can be scored without training again
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+BRAINAGE_DIR = 'brainage'
+
+
+def load_training(output_dir, cn_label):
+    df_structural = pd.read_csv(os.path.join(output_dir, 'structural_features.csv'), index_col=0)
+    df_clinical = pd.read_csv(os.path.join(output_dir, 'clinical.csv'), index_col=0)
+    return df_structural, df_clinical[cn_label].reindex(df_structural.index).fillna(0).astype(bool)
+
+
+def fold_ids(n, n_folds, seed=0):
+    folds = np.arange(n) % n_folds
+    np.random.default_rng(seed).shuffle(folds)
+    return folds
+
+
+# Ridge solution of standardized features from the sums, Gram matrix and cross products of
+# one or more training sets, batched over the leading axis
+def solve_ridge(n, x_sum, gram, y_sum, xy, alpha=0.0):
+    x_mean = x_sum / n[:, None]
+    y_mean = y_sum / n
+    cov = gram - n[:, None, None] * x_mean[:, :, None] * x_mean[:, None, :]
+    cross = xy - n[:, None] * x_mean * y_mean[:, None]
+    scale = np.sqrt(np.diagonal(cov, axis1=1, axis2=2) / n[:, None])
+    scale[scale == 0] = 1
+    system = cov / (scale[:, :, None] * scale[:, None, :]) + alpha * np.eye(cov.shape[1])
+    coef = np.linalg.solve(system, (cross / scale)[..., None])[..., 0] / scale
+    intercept = y_mean - (x_mean * coef).sum(axis=1)
+    return coef, intercept
+
+
+def cross_validate(X, age, n_folds=5, alpha=0.0, seed=0):
+    # Statistics of each fold over contiguous rows, the training set of a fold being everything else
+    folds = fold_ids(len(age), n_folds, seed)
+    order = np.argsort(folds, kind='stable')
+    n_fold = np.bincount(folds, minlength=n_folds)
+    bounds = np.concatenate([[0], np.cumsum(n_fold)])
+    X_sorted, age_sorted = X[order], age[order]
+    x_fold = np.add.reduceat(X_sorted, bounds[:-1], axis=0)
+    y_fold = np.add.reduceat(age_sorted, bounds[:-1])
+    gram_fold = np.stack([X_sorted[a:b].T @ X_sorted[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+    xy_fold = np.stack([X_sorted[a:b].T @ age_sorted[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+    coef, intercept = solve_ridge(n_fold.sum() - n_fold, x_fold.sum(axis=0) - x_fold,
+                                  gram_fold.sum(axis=0) - gram_fold, y_fold.sum() - y_fold,
+                                  xy_fold.sum(axis=0) - xy_fold, alpha)
+
+    predicted = (X * coef[folds]).sum(axis=1) + intercept[folds]
+    errors = predicted - age
+    metrics = []
+    for k in range(n_folds):
+        in_fold = folds == k
+        metrics.append({'fold': k, 'n': int(in_fold.sum()), 'mae': float(np.abs(errors[in_fold]).mean()),
+                        'r': float(np.corrcoef(predicted[in_fold], age[in_fold])[0, 1])})
+    return predicted, metrics
+
+
+def fit_brainage(df_structural, cn, n_folds=5, alpha=0.0, seed=0):
+    features = [col for col in df_structural.columns if col != 'age']
+    df_train = df_structural[cn.to_numpy()].dropna()
+    X = df_train[features].to_numpy(dtype=float)
+    age = df_train['age'].to_numpy(dtype=float)
+    if len(age) < 2 * n_folds:
+        raise ValueError(f'Only {len(age)} CN participants with complete features to train on')
+
+    # Linear age bias of the out-of-fold predictions, removed from the predicted age
+    predicted, metrics = cross_validate(X, age, n_folds, alpha, seed)
+    bias_slope, bias_intercept = np.polyfit(age, predicted, 1)
+
+    coef, intercept = solve_ridge(np.array([len(age)]), X.sum(axis=0)[None], (X.T @ X)[None],
+                                  age.sum()[None], (X.T @ age)[None], alpha)
+    model = {
+        'features': features,
+        'coefficients': coef[0].tolist(),
+        'intercept': float(intercept[0]),
+        'bias_intercept': float(bias_intercept),
+        'bias_slope': float(bias_slope),
+        'n_train': len(age),
+        'n_folds': n_folds,
+        'alpha': alpha,
+        'seed': seed,
+        'cv_mae': float(np.abs(predicted - age).mean()),
+        'cv_r': float(np.corrcoef(predicted, age)[0, 1]),
+        'folds': metrics,
+    }
+    return model, pd.Series(predicted, index=df_train.index, name='predicted_age_all')
+
+
+# Predicted, bias-corrected age and delta of each scan, in the columns written by ageml.
+# Scans with an out-of-fold prediction keep it instead of that of the final model
+def predict_brainage(model, df_structural, cv_predicted=None):
+    X = df_structural[model['features']].to_numpy(dtype=float)
+    age = df_structural['age'].to_numpy(dtype=float)
+    predicted = X @ np.array(model['coefficients']) + model['intercept']
+    if cv_predicted is not None:
+        held_out = cv_predicted.reindex(df_structural.index).to_numpy()
+        predicted = np.where(np.isnan(held_out), predicted, held_out)
+    delta = predicted - (model['bias_intercept'] + model['bias_slope'] * age)
+    return pd.DataFrame({'age': age, 'predicted_age_all': predicted, 'corrected_age_all': age + delta,
+                         'delta_all': delta}, index=df_structural.index)
+
+
+# Key of the training data and settings, so that the model is only refit when they change
+def training_key(df_structural, cn, **settings):
+    hashes = pd.util.hash_pandas_object(df_structural.assign(cn=cn), index=True).to_numpy()
+    return hashlib.sha256(hashes.tobytes() + repr(sorted(settings.items())).encode()).hexdigest()
+
+
+def save_model(model, path):
+    with open(path, 'w') as f:
+        json.dump(model, f, indent=2)
+
+
+def load_model(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def brainage_cohort(spec, df_structural=None, cn=None, n_folds=5, alpha=0.0, seed=0, cache=True):
+    if df_structural is None:
+        df_structural, cn = load_training(spec.output_dir, spec.cn_label)
+    output_dir = os.path.join(spec.output_dir, BRAINAGE_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, 'model.json')
+    cv_path = os.path.join(output_dir, 'cv_predicted_age.csv')
+    key = training_key(df_structural, cn, n_folds=n_folds, alpha=alpha, seed=seed)
+
+    model = load_model(model_path) if cache and os.path.exists(model_path) and os.path.exists(cv_path) else None
+    if model is None or model.get('key') != key:
+        model, cv_predicted = fit_brainage(df_structural, cn, n_folds, alpha, seed)
+        model['key'] = key
+        save_model(model, model_path)
+        cv_predicted.to_csv(cv_path)
+    else:
+        cv_predicted = pd.read_csv(cv_path, index_col=0)['predicted_age_all']
+
+    # CN participants get their out-of-fold predictions and the rest the model trained on all CN
+    df_predicted = predict_brainage(model, df_structural.dropna(), cv_predicted)
+    df_predicted.insert(0, spec.cn_label, cn[df_predicted.index].astype(int))
+    df_predicted.to_csv(os.path.join(output_dir, 'predicted_age.csv'))
+    return model
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    from cohorts import COHORTS
+
+    parser = argparse.ArgumentParser(description='Train BrainAge models on the processed cohorts or score new scans')
+    parser.add_argument('cohorts', nargs='*', metavar='COHORT',
+                        help=f'Cohorts to model among {", ".join(COHORTS)} (default: all)')
+    parser.add_argument('--data-root', default=None, help='Root folder with the cohort data')
+    parser.add_argument('--folds', type=int, default=5, help='Number of cross-validation folds')
+    parser.add_argument('--alpha', type=float, default=0.0, help='Ridge penalty on the standardized features')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the fold assignment')
+    parser.add_argument('--refit', dest='cache', action='store_false', help='Train even if a cached model matches')
+    parser.add_argument('--score', nargs=3, metavar=('MODEL', 'SCANS', 'OUTPUT'), default=None,
+                        help='Score a csv of new scans indexed by ID with a saved model.json')
+    args = parser.parse_args()
+
+    if args.score is not None:
+        model_path, scans_path, output_path = args.score
+        predict_brainage(load_model(model_path), pd.read_csv(scans_path, index_col=0)).to_csv(output_path)
+        raise SystemExit
+
+    unknown = set(args.cohorts) - set(COHORTS)
+    if unknown:
+        raise SystemExit(f'Unknown cohorts: {", ".join(sorted(unknown))}')
+    specs = [COHORTS[name] for name in args.cohorts or COHORTS]
+    if args.data_root is not None:
+        specs = [spec.with_data_root(args.data_root) for spec in specs]
+    process = partial(brainage_cohort, n_folds=args.folds, alpha=args.alpha, seed=args.seed, cache=args.cache)
+    with ProcessPoolExecutor(max_workers=min(len(specs), os.cpu_count() or 1)) as executor:
+        for spec, model in zip(specs, executor.map(process, specs)):
+            print(f'{spec.name}: trained on {model["n_train"]} CN, CV MAE {model["cv_mae"]:.2f} years, '
+                  f'r {model["cv_r"]:.3f}')
@@ -0,0 +1,270 @@
+import os
+import re
+from dataclasses import dataclass, field, replace
+
+import numpy as np
+
+from schema import Schema
+
+
+# Declarative description of one cohort freeze. Everything that used to differ
+# between preprocess_A4.py, preprocess_HABS.py and preprocess_ADNI.py lives here
+@dataclass(frozen=True)
+class CohortSpec:
+    name: str
+    freeze: str
+    data_root: str = 'data/final'
+
+    # Index of the baseline file and visit date column of the long file, which the engine
+    # orders by MonthsFromBaseline_raw and only the synthetic generator writes
+    baseline_id: str = 'ID'
+    long_date: str = None
+
+    # Participant cleaning and inclusion
+    exclude_ids: tuple = ()
+    drop_duplicate_ids: bool = False
+    amyloid_col: str = 'SUMMARY_SUVR_AMYLOID'
+    diagnosis_filter: str = None
+
+    # Name bilateral features by the full region name instead of its first token,
+    # needed for parcellations such as Destrieux where first tokens repeat
+    full_region_names: bool = False
+
+    # Reference set for ICV normalization: diagnosis value or None for the whole sample
+    icv_reference: str = None
+
+    # Clinical file: e4 and amyloid group columns, amyloid negative/positive codes,
+    # name of the CN flag, whether CN also requires a CN diagnosis and which groups to write
+    ab_group_col: str = 'Amyloid_group'
+    ab_negative: object = 'Ab-'
+    ab_positive: object = 'Ab+'
+    cn_label: str = 'cn'
+    cn_requires_diagnosis: bool = False
+    clinical_groups: str = 'cn_vs_rest'
+
+    # Time differences to MRI are either from months since baseline or from dates
+    time_unit: str = 'date'
+    mri_time: str = 'MRI_SessionDate'
+    time_sources: dict = field(default_factory=dict)
+
+    # Regular expression of the regional tau columns with a region and optional hemi group.
+    # The tau composite averages every matched region. Subcortical tau columns (hippocampus,
+    # amygdala) not matched by it are added to the region registry of tau.py only
+    tau_region: str = None
+    tau_subcortical: str = None
+
+    # Raw ptau column and lower bound below which reads are invalid
+    ptau_col: str = 'ptau'
+    ptau_min: float = None
+
+    # Renaming and recoding to the shared naming conventions
+    rename: dict = field(default_factory=dict)
+    ab_status_map: dict = field(default_factory=dict)
+    diagnosis_constant: str = None
+    derive: object = None
+    derive_cols: tuple = ()
+    output_cols: tuple = ()
+
+    # Dtypes, date formats and censoring of the columns applied when reading
+    schema: Schema = None
+
+    @property
+    def directory(self):
+        return os.path.join(self.data_root, self.name)
+
+    @property
+    def baseline_path(self):
+        return os.path.join(self.directory, f'{self.name}_baseline_{self.freeze}.csv')
+
+    @property
+    def long_path(self):
+        return os.path.join(self.directory, f'{self.name}_long_{self.freeze}.csv')
+
+    @property
+    def output_dir(self):
+        return os.path.join(self.directory, 'processed')
+
+    # Columns of the wide baseline file used by any stage of the engine
+    def uses_baseline_column(self, col):
+        if 'MRI_' in col or (self.tau_region is not None and re.search(self.tau_region, col)):
+            return True
+        return col in {self.baseline_id, self.amyloid_col, self.ab_group_col, self.mri_time, self.ptau_col,
+                       'Diagnosis', 'e4_carrier', *self.time_sources.values(), *self.rename,
+                       *self.derive_cols, *self.output_cols}
+
+    # Narrow columns needed to decide which participants are included
+    @property
+    def key_columns(self):
+        columns = [self.baseline_id, self.amyloid_col, 'MRI_Age']
+        if self.diagnosis_filter is not None:
+            columns.append('Diagnosis')
+        return columns
+
+    # Columns of the long format file used to count visits and follow-up
+    @property
+    def long_columns(self):
+        return ('ID', 'zPACC', 'MonthsFromBaseline_raw')
+
+    # Patterns of every regional tau column used to build the region registry
+    @property
+    def tau_patterns(self):
+        return tuple(p for p in (self.tau_region, self.tau_subcortical) if p is not None)
+
+    def with_freeze(self, freeze):
+        return replace(self, freeze=freeze)
+
+    def with_data_root(self, data_root):
+        return replace(self, data_root=data_root)
+
+
+# A4 participants are split by substudy and treatment arm
+def derive_a4_cohort(df_baseline):
+    conditions = [
+        ((df_baseline['SUBSTUDY'] == 'SF') | (df_baseline['SUBSTUDY'] == 'LEARN')),
+        ((df_baseline['SUBSTUDY'] == 'A4') & (df_baseline['TX'] == 'Placebo')),
+        ((df_baseline['SUBSTUDY'] == 'A4') & (df_baseline['TX'] == 'Solanezumab'))
+    ]
+    choices = ['LEARN/SF', 'A4 Placebo', 'A4 Treated']
+    df_baseline['cohort'] = np.select(conditions, choices, default=None)
+    return df_baseline
+
+
+# Codes shared by every cohort. Diagnosis, substudy and arm keep the categories found in the data
+SHARED_CATEGORIES = {'Sex': (0, 1), 'e4_carrier': (0, 1), 'Diagnosis': None}
+
+# Regional FreeSurfer volumes and thicknesses are stored as float32
+ROI_FLOAT32 = (r'^MRI_FS7_rnr_',)
+
+COMMON_COLS = ('mri_age', 'sex', 'e4_carrier', 'ab_status', 'edu', 'diagnosis', 'mri_date', 'PACC_mri', 'time_diff_pacc',
+               'follow_up_time', 'ab_composite', 'time_diff_ab', 'ptau', 'time_diff_ptau', 'tau_composite', 'time_diff_tau',
+               'exploratory')
+
+# A4 has no dates so time differences use months from baseline
+A4 = CohortSpec(
+    name='a4',
+    freeze='041125',
+    # Participant with outlier MRI
+    exclude_ids=('B66388909_a4',),
+    amyloid_col='summary_suvr_amyloid',
+    time_unit='months',
+    mri_time='MonthsFromBaseline_MRI',
+    time_sources={
+        'pacc': 'MonthsFromBaseline_raw',
+        'ab': 'MonthsFromBaseline_amyloid',
+        'ptau': 'MonthsFromBaseline_ptau217',
+        'tau': 'MonthsFromBaseline_tau',
+    },
+    tau_region=r'PVC_(?P<region>.+?)_bh',
+    schema=Schema(
+        categories={**SHARED_CATEGORIES, 'Amyloid_group': ('Ab-', 'Ab+'), 'SUBSTUDY': None, 'TX': None},
+        float32=ROI_FLOAT32 + (r'PVC_.+?_bh',),
+        # ptau217 reads below and above the limits of quantification
+        censored={'ptau217_read': {'<LLOQ': 'below', '>ULOQ': 'above'}},
+    ),
+    ptau_col='ptau217_read',
+    # Ptau use the p/np ratio and the C2N platform
+    rename={
+        'MRI_Age': 'mri_age',
+        'Sex': 'sex',
+        'Education': 'edu',
+        'zPACC': 'PACC_mri',
+        'Amyloid_group': 'ab_status',
+        'Amyloid_Centiloid': 'ab_composite',
+        'ptau217_read': 'ptau',
+        'MonthsFromBaseline_MRI': 'time_baseline_to_mri',
+    },
+    ab_status_map={'Ab+': 'ab+', 'Ab-': 'ab-'},
+    # All are technically CU at start of the study
+    diagnosis_constant='CN',
+    derive=derive_a4_cohort,
+    derive_cols=('SUBSTUDY', 'TX'),
+    output_cols=('mri_age', 'sex', 'e4_carrier', 'ab_status', 'edu', 'diagnosis', 'cohort', 'TX', 'time_baseline_to_mri',
+                 'PACC_mri', 'time_diff_pacc', 'follow_up_time', 'ab_composite', 'time_diff_ab', 'ptau', 'time_diff_ptau',
+                 'tau_composite', 'time_diff_tau', 'exploratory'),
+)
+
+# Date of blood samples is same as the NP date in HABS
+HABS = CohortSpec(
+    name='habs',
+    freeze='040925',
+    baseline_id='SubjIDshort',
+    long_date='NP_SessionDate',
+    amyloid_col='PIB_FS_DVR_FLR',
+    # Only interested in cognitively unimpaired
+    diagnosis_filter='CN',
+    ab_group_col='PIB_FS_DVR_Group',
+    ab_negative='PIB-',
+    ab_positive='PIB+',
+    clinical_groups='e4_ab',
+    time_sources={
+        'pacc': 'NP_SessionDate',
+        'ab': 'PIB_SessionDate',
+        'ptau': 'NP_SessionDate',
+        'tau': 'TAU_SessionDate',
+    },
+    tau_region=r'TAU_HRC_FS_SUVR_PVC_(?P<region>.+?)_bh',
+    schema=Schema(
+        dates={col: 'ISO8601' for col in ('MRI_SessionDate', 'NP_SessionDate', 'PIB_SessionDate', 'TAU_SessionDate')},
+        categories={**SHARED_CATEGORIES, 'PIB_FS_DVR_Group': ('PIB-', 'PIB+')},
+        float32=ROI_FLOAT32 + (r'TAU_HRC_FS_SUVR_PVC_.+?_bh',),
+    ),
+    ptau_col='p_tau217_ratio',
+    rename={
+        'MRI_Age': 'mri_age',
+        'Sex': 'sex',
+        'Education': 'edu',
+        'Diagnosis': 'diagnosis',
+        'zPACC': 'PACC_mri',
+        'PIB_FS_DVR_Group': 'ab_status',
+        'Centiloid': 'ab_composite',
+        'p_tau217_ratio': 'ptau',
+        'MRI_SessionDate': 'mri_date',
+    },
+    ab_status_map={'PIB+': 'ab+', 'PIB-': 'ab-'},
+    output_cols=COMMON_COLS,
+)
+
+# ADNI normalizes ICV with respect to CN and CN controls also need a CN diagnosis
+ADNI = CohortSpec(
+    name='adni',
+    freeze='040725',
+    long_date='Date',
+    drop_duplicate_ids=True,
+    icv_reference='CN',
+    ab_group_col='AMYLOID_STATUS',
+    ab_negative=0.0,
+    ab_positive=1.0,
+    cn_label='CN',
+    cn_requires_diagnosis=True,
+    time_sources={
+        'pacc': 'Clinical_Date',
+        'ab': 'AB_SCANDATE',
+        'ptau': 'PLASMA_DATE',
+        'tau': 'TAU_SCANDATE',
+    },
+    tau_region=r'PVC_CTX_(?:(?P<hemi>LH|RH)_)?(?P<region>.+?)_SUVR_TAU',
+    tau_subcortical=r'PVC_(?P<hemi>LEFT|RIGHT)_(?P<region>HIPPOCAMPUS|AMYGDALA)_SUVR_TAU',
+    schema=Schema(
+        dates={col: 'ISO8601' for col in ('MRI_SessionDate', 'Clinical_Date', 'AB_SCANDATE', 'PLASMA_DATE', 'TAU_SCANDATE')},
+        categories={**SHARED_CATEGORIES, 'AMYLOID_STATUS': (0, 1)},
+        float32=ROI_FLOAT32 + (r'PVC_.+?_SUVR_TAU',),
+    ),
+    ptau_col='pT217_AB42_F',
+    ptau_min=0,
+    # Ptau use pTau217 to AB42 ratio
+    rename={
+        'MRI_Age': 'mri_age',
+        'Sex': 'sex',
+        'Education': 'edu',
+        'Diagnosis': 'diagnosis',
+        'zPACC': 'PACC_mri',
+        'AMYLOID_STATUS': 'ab_status',
+        'CENTILOIDS_AMYLOID': 'ab_composite',
+        'pT217_AB42_F': 'ptau',
+        'MRI_SessionDate': 'mri_date',
+    },
+    ab_status_map={1: 'ab+', 0: 'ab-'},
+    output_cols=COMMON_COLS,
+)
+
+COHORTS = {spec.name: spec for spec in (A4, HABS, ADNI)}
@@ -0,0 +1,191 @@
+# Enrichment of a PACC trial by screening thresholds. For every cell of a grid of thresholds
+# on pTau217, BrainAge delta and optionally tau-PET, the participants above all thresholds
+# are pooled and the sample size needed to detect a slowing of their PACC decline is computed
+# with the Edland formula from two-stage variance components. The sums behind the variance
+# components of every cell come from one histogram of the participants over the grid and
+# reverse cumulative sums along each axis, and bootstrap intervals resample all cells at once
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from longitudinal import stream_pacc_slopes
+
+
+def load_enrichment(spec, group=None):
+    df_baseline = pd.read_csv(os.path.join(spec.output_dir, 'baseline.csv'), index_col='ID')
+    slopes_path = os.path.join(spec.output_dir, 'pacc_slopes.csv')
+    if os.path.exists(slopes_path):
+        df_slopes = pd.read_csv(slopes_path, index_col='ID')
+    else:
+        df_slopes = stream_pacc_slopes(spec.long_path)
+    df = df_baseline.join(df_slopes, how='inner')
+
+    predicted_path = os.path.join(spec.output_dir, 'brainage', 'predicted_age.csv')
+    if os.path.exists(predicted_path):
+        df = df.join(pd.read_csv(predicted_path, index_col='ID')['delta_all'].rename('delta'))
+    if group is not None:
+        if 'cohort' not in df.columns:
+            raise ValueError(f'{spec.name} has no cohort groups to select {group!r} from')
+        df = df[df['cohort'] == group]
+    return df
+
+
+# Terms summed over each cell (count, slope, squared slope, inverse time spread, residual
+# degrees of freedom and residual sum of squares) of the participants with at least three
+# visits, for whom both the slope and its sampling variance are estimated
+def subject_stats(df):
+    df = df[df['pacc_n_visits'] > 2]
+    dof = df['pacc_n_visits'].to_numpy(dtype=float) - 2
+    residual_var = df['pacc_residual_var'].to_numpy(dtype=float)
+    slope = df['pacc_slope'].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        inv_stt = np.where(residual_var > 0, df['pacc_slope_se'].to_numpy(dtype=float) ** 2 / residual_var, 0)
+    stats = np.column_stack([np.ones(len(df)), slope, slope ** 2, inv_stt, dof, dof * residual_var])
+    return df, stats
+
+
+# Index of the highest threshold each participant reaches on every axis, -1 when below all
+# thresholds or missing
+def threshold_bins(df, axes, thresholds):
+    bins = []
+    for axis in axes:
+        values = df[axis].to_numpy(dtype=float)
+        index = np.searchsorted(thresholds[axis], values, side='right') - 1
+        index[np.isnan(values)] = -1
+        bins.append(index)
+    return np.array(bins)
+
+
+def reverse_cumsum(sums, axes):
+    for axis in axes:
+        sums = np.flip(np.cumsum(np.flip(sums, axis), axis=axis), axis)
+    return sums
+
+
+# Sums of each statistic over the participants above every threshold of each cell, for
+# one or several weightings of the participants (bootstrap replicates along the first axis)
+def cell_sums(bins, stats, shape, weights=None):
+    weights = np.ones((1, stats.shape[0])) if weights is None else weights
+    inside = (bins >= 0).all(axis=0)
+    cells = np.ravel_multi_index(bins[:, inside], shape)
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if len(cells) else np.array([], dtype=int)
+
+    sums = np.zeros((weights.shape[0], int(np.prod(shape)), stats.shape[1]))
+    if len(cells):
+        weights = weights[:, inside][:, order]
+        stats = stats[inside][order]
+        for k in range(stats.shape[1]):
+            sums[:, cells[starts], k] = np.add.reduceat(weights * stats[:, k], starts, axis=1)
+    sums = sums.reshape(weights.shape[0], *shape, stats.shape[1])
+    return reverse_cumsum(sums, range(1, len(shape) + 1))
+
+
+# Variance components from the sums of a cell and total sample size of a two-arm trial
+# detecting a relative slowing of the mean decline with visits at times t
+def sample_size(sums, t, effect=0.3, power=0.8, alpha=0.05):
+    n, slope, slope_sq, inv_stt, dof, dof_residual_var = np.moveaxis(sums, -1, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_slope = slope / n
+        slope_var = (slope_sq - n * mean_slope ** 2) / (n - 1)
+        residual_var = dof_residual_var / dof
+        random_slope_var = np.maximum(slope_var - residual_var * inv_stt / n, 0)
+        z = NormalDist().inv_cdf(1 - alpha / 2) + NormalDist().inv_cdf(power)
+        t = np.asarray(t, dtype=float)
+        per_arm = 2 * z ** 2 * (random_slope_var + residual_var / ((t - t.mean()) ** 2).sum()) / (effect * mean_slope) ** 2
+        per_arm = np.where(n > 2, np.ceil(per_arm), np.nan)
+    return {'n_participants': n, 'mean_slope': mean_slope, 'random_slope_var': random_slope_var,
+            'residual_var': residual_var, 'n_trial_required': 2 * per_arm}
+
+
+def bootstrap_chunk(bins, stats, shape, t, n_replicates, seed, trial):
+    rng = np.random.default_rng(seed)
+    n = stats.shape[0]
+    weights = rng.multinomial(n, np.full(n, 1 / n), size=n_replicates).astype(float)
+    required = sample_size(cell_sums(bins, stats, shape, weights), t, **trial)['n_trial_required']
+    # Reduction relative to the first cell, which holds every participant with the measures
+    reference = required.reshape(n_replicates, -1)[:, :1].reshape((n_replicates,) + (1,) * len(shape))
+    return required, 100 * required / reference
+
+
+def bootstrap(bins, stats, shape, t, n_replicates, seed=0, workers=None, chunk=100, trial=None):
+    trial = trial or {}
+    sizes = [min(chunk, n_replicates - start) for start in range(0, n_replicates, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        chunks = list(executor.map(bootstrap_chunk, *zip(*[(bins, stats, shape, t, size, s, trial)
+                                                           for size, s in zip(sizes, seeds)])))
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+
+def quantile_thresholds(df, axes, steps):
+    levels = np.arange(steps) / steps
+    return {axis: np.unique(np.nanquantile(df[axis].to_numpy(dtype=float), levels)) for axis in axes}
+
+
+def enrichment_grid(df, axes=('ptau', 'delta'), steps=20, trial_years=4, visits_per_year=2, n_bootstrap=1000,
+                    level=0.95, seed=0, workers=None, **trial):
+    missing = [axis for axis in axes if axis not in df.columns]
+    if missing:
+        raise ValueError(f'No {", ".join(missing)} column. BrainAge deltas are read from processed/brainage')
+    df = df.dropna(subset=list(axes))
+    df, stats = subject_stats(df)
+    thresholds = quantile_thresholds(df, axes, steps)
+    shape = tuple(len(thresholds[axis]) for axis in axes)
+    bins = threshold_bins(df, axes, thresholds)
+    t = np.arange(0, trial_years + 1e-9, 1 / visits_per_year)
+
+    estimates = sample_size(cell_sums(bins, stats, shape)[0], t, **trial)
+    grid = np.meshgrid(*[thresholds[axis] for axis in axes], indexing='ij')
+    df_grid = pd.DataFrame({f'{axis}_threshold': values.ravel() for axis, values in zip(axes, grid)})
+    for name, values in estimates.items():
+        df_grid[name] = values.ravel()
+    df_grid['n_participants'] = df_grid['n_participants'].astype(int)
+    df_grid['reduction_percentage'] = 100 * df_grid['n_trial_required'] / df_grid['n_trial_required'].iloc[0]
+
+    if n_bootstrap:
+        required, reduction = bootstrap(bins, stats, shape, t, n_bootstrap, seed, workers, trial=trial)
+        tails = 100 * np.array([(1 - level) / 2, (1 + level) / 2])
+        for name, values in (('n', required), ('reduction', reduction)):
+            lower, upper = np.nanpercentile(values.reshape(n_bootstrap, -1), tails, axis=0)
+            df_grid[f'{name}_ci_lower'] = lower
+            df_grid[f'{name}_ci_upper'] = upper
+    return df_grid
+
+
+if __name__ == '__main__':
+    from cohorts import COHORTS
+
+    parser = argparse.ArgumentParser(description='Sample size of an enriched PACC trial over a grid of thresholds')
+    parser.add_argument('cohort', help=f'One of {", ".join(COHORTS)}')
+    parser.add_argument('--data-root', default=None, help='Root folder with the cohort data')
+    parser.add_argument('--group', default=None, help='Only participants of this A4 cohort group, e.g. "A4 Placebo"')
+    parser.add_argument('--axis', action='append', default=None, metavar='COLUMN',
+                        help='Screening measure with a threshold axis (default: ptau and delta)')
+    parser.add_argument('--steps', type=int, default=20, help='Number of quantile thresholds per axis')
+    parser.add_argument('--trial-years', type=float, default=4, help='Duration of the trial')
+    parser.add_argument('--visits-per-year', type=float, default=2, help='Visits per year in the trial')
+    parser.add_argument('--effect', type=float, default=0.3, help='Relative slowing of the decline by treatment')
+    parser.add_argument('--power', type=float, default=0.8)
+    parser.add_argument('--alpha', type=float, default=0.05, help='Two-sided significance level')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Bootstrap replicates for the intervals')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='Processes for the bootstrap')
+    parser.add_argument('--output', default=None, help='Where to save the grid (default: processed/enrichment_grid.csv)')
+    args = parser.parse_args()
+
+    spec = COHORTS[args.cohort]
+    if args.data_root is not None:
+        spec = spec.with_data_root(args.data_root)
+    df_grid = enrichment_grid(load_enrichment(spec, args.group), tuple(args.axis or ('ptau', 'delta')), args.steps,
+                              args.trial_years, args.visits_per_year, args.bootstrap, seed=args.seed,
+                              workers=args.workers, effect=args.effect, power=args.power, alpha=args.alpha)
+    df_grid.to_csv(args.output or os.path.join(spec.output_dir, 'enrichment_grid.csv'), index=False)
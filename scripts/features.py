@@ -0,0 +1,55 @@
+# Feature engineering for the structural MRI features. Left and right hemisphere
+# columns are paired once by parsing their region names and summed in one array operation
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# Cortical regions use lh_/rh_ and subcortical volumes Left/Right
+HEMISPHERE = re.compile(r'^(?P<hemisphere>lh|rh|Left|Right)[_-](?P<region>.+)$')
+FAMILIES = {'lh': ('cortical', 0), 'rh': ('cortical', 1), 'Left': ('subcortical', 0), 'Right': ('subcortical', 1)}
+
+
+# Pairing of left and right columns by region. Returns the positions of the left and right
+# columns, the name of each bilateral feature and which of them are subcortical volumes
+def bilateral_index(columns, full_names=False):
+    pairs = {}
+    for position, col in enumerate(columns):
+        match = HEMISPHERE.match(col)
+        if match is None:
+            continue
+        family, side = FAMILIES[match['hemisphere']]
+        sides = pairs.setdefault((family, match['region']), [None, None])
+        if sides[side] is not None:
+            raise ValueError(f'Duplicated hemisphere column for {match["region"]}: {col}')
+        sides[side] = position
+
+    unpaired = [columns[p] for sides in pairs.values() for p in sides if p is not None and None in sides]
+    if unpaired:
+        raise ValueError(f'Hemisphere columns without a contralateral pair: {", ".join(unpaired)}')
+
+    # Cortical pairs first then subcortical, each in the order of the left hemisphere columns
+    keys = sorted(pairs, key=lambda key: (key[0] != 'cortical', pairs[key][0]))
+    left = np.array([pairs[key][0] for key in keys], dtype=int)
+    right = np.array([pairs[key][1] for key in keys], dtype=int)
+    names = ['bi_' + (region if full_names else region.split('_')[0]) for _, region in keys]
+    volumes = [name for name, (family, _) in zip(names, keys) if family == 'subcortical']
+
+    duplicated = sorted(name for name, count in Counter(names).items() if count > 1)
+    if duplicated:
+        raise ValueError(f'Several hemisphere pairs map to {", ".join(duplicated)}; use full region names')
+    return left, right, names, volumes
+
+
+# Replace each left/right pair of columns by their bilateral sum
+def combine_bilateral(df, full_names=False):
+    left, right, names, volumes = bilateral_index(list(df.columns), full_names)
+    # Sums keep the float32 precision of regional blocks
+    dtype = np.result_type(np.float32, *df.dtypes.iloc[np.r_[left, right]])
+    values = df.iloc[:, left].to_numpy(dtype=dtype) + df.iloc[:, right].to_numpy(dtype=dtype)
+    df_bilateral = pd.DataFrame(values, index=df.index, columns=names)
+
+    paired = np.zeros(df.shape[1], dtype=bool)
+    paired[left] = paired[right] = True
+    return pd.concat([df.loc[:, ~paired], df_bilateral], axis=1), volumes
@@ -0,0 +1,46 @@
+# Participant-inclusion funnel as a lazy query plan over the key columns of a cohort.
+# Steps are only recorded until the plan is executed, so the wide baseline columns
+# are read afterwards for the participants that survive every step
+import pandas as pd
+
+
+class QueryPlan:
+    def __init__(self):
+        self.steps = []
+
+    # Add a step keeping the rows where predicate(df) is True
+    def filter(self, name, predicate):
+        self.steps.append((name, predicate))
+        return self
+
+    # Run every step in order and count how many participants each one removes
+    def execute(self, df):
+        report = []
+        for name, predicate in self.steps:
+            before = len(df)
+            df = df[predicate(df).to_numpy()]
+            report.append({'step': name, 'before': before, 'removed': before - len(df), 'remaining': len(df)})
+        return df, pd.DataFrame(report, columns=['step', 'before', 'removed', 'remaining'])
+
+
+def inclusion_plan(spec):
+    plan = QueryPlan()
+
+    # Remove outlier participants and baseline duplicated participants
+    if spec.exclude_ids:
+        plan.filter('outlier IDs', lambda df: ~df['ID'].isin(spec.exclude_ids))
+    if spec.drop_duplicate_ids:
+        plan.filter('duplicated IDs', lambda df: ~df['ID'].duplicated(keep='first'))
+
+    # Keep only participants with more than two time points and at least 0.5 years of follow-up
+    plan.filter('fewer than 2 PACC visits', lambda df: df['nTimePoints'] >= 2)
+    plan.filter('follow-up under 0.5 years', lambda df: df['follow_up_time'] >= 0.5)
+
+    # Only keep subjects that have MRI and Amyloid measures
+    plan.filter('missing amyloid', lambda df: df[spec.amyloid_col].notna())
+    plan.filter('missing MRI', lambda df: df['MRI_Age'].notna())
+
+    # Remove participants outside the diagnosis of interest
+    if spec.diagnosis_filter is not None:
+        plan.filter(f'diagnosis not {spec.diagnosis_filter}', lambda df: df['Diagnosis'] == spec.diagnosis_filter)
+    return plan
@@ -0,0 +1,68 @@
+# Adjustment of regional volumes for total intracranial volume (ICV). Every volume is
+# regressed on ICV in a reference set with one closed-form least-squares solve over the
+# whole block of columns, and the slopes are saved so that new scans can be adjusted
+# without refitting the cohort
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def fit_icv(df_structural, columns, mask=None, icv_col='ICV_vol'):
+    if mask is None:
+        mask = np.ones(len(df_structural), dtype=bool)
+    mask = np.asarray(mask, dtype=bool)
+    icv = df_structural[icv_col].to_numpy(dtype=float)[mask]
+    volumes = df_structural[list(columns)].to_numpy(dtype=float)[mask]
+
+    # Slope of each column over the rows where both it and ICV are available
+    valid = ~np.isnan(volumes) & ~np.isnan(icv)[:, None]
+    n = valid.sum(axis=0)
+    x = np.where(valid, icv[:, None], 0.0)
+    y = np.where(valid, volumes, 0.0)
+    x_centered = np.where(valid, x - x.sum(axis=0)/n, 0.0)
+    y_centered = np.where(valid, y - y.sum(axis=0)/n, 0.0)
+    slopes = (x_centered * y_centered).sum(axis=0) / (x_centered ** 2).sum(axis=0)
+
+    return {
+        'icv_col': icv_col,
+        'icv_mean': float(np.nanmean(icv)),
+        'n_reference': int(mask.sum()),
+        'slopes': dict(zip(columns, slopes.tolist())),
+    }
+
+
+# Remove the effect of ICV relative to the mean ICV of the reference set
+def apply_icv(df_structural, coefficients):
+    df_structural = df_structural.copy()
+    columns = list(coefficients['slopes'])
+    slopes = np.array([coefficients['slopes'][col] for col in columns])
+    icv = df_structural[coefficients['icv_col']].to_numpy(dtype=float)
+    adjustment = np.outer(icv - coefficients['icv_mean'], slopes)
+    adjusted = df_structural[columns].to_numpy(dtype=float) - adjustment
+
+    # Adjusted volumes keep the precision they were stored with
+    dtype = np.result_type(np.float32, *df_structural[columns].dtypes)
+    df_structural[columns] = adjusted.astype(dtype)
+    return df_structural
+
+
+def save_coefficients(coefficients, path):
+    with open(path, 'w') as f:
+        json.dump(coefficients, f, indent=2)
+
+
+def load_coefficients(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adjust new scans with saved ICV coefficients')
+    parser.add_argument('coefficients', help='icv_coefficients.json written by preprocess.py')
+    parser.add_argument('scans', help='csv of new scans indexed by ID, with the bi_ volumes of structural_features.csv and icv_vol')
+    parser.add_argument('output', help='Where to save the adjusted scans')
+    args = parser.parse_args()
+    df_scans = pd.read_csv(args.scans, index_col=0)
+    apply_icv(df_scans, load_coefficients(args.coefficients)).to_csv(args.output)
@@ -0,0 +1,151 @@
+# Incremental reprocessing across data freezes. Each included subject is hashed from
+# their baseline row and visit summary, and their derived structural, clinical and
+# baseline records are cached in processed/.incremental. On the next freeze only new or
+# changed subjects are derived again and the ICV fit is only redone when its reference
+# set moved
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrument import Profiler
+
+# Bump when the derivation of the records changes so that caches are rebuilt
+ENGINE_VERSION = 3
+STATE_DIR = '.incremental'
+RECORDS = ('bilateral', 'clinical', 'baseline')
+
+
+# Settings of the cohort spec that the cached records depend on. Input columns are left out
+# so that a freeze adding columns keeps the cache, and are compared per subject instead
+def fingerprint(spec):
+    fields = {name: getattr(value, '__qualname__', value) for name, value in vars(spec).items()
+              if name not in ('freeze', 'data_root')}
+    text = repr((ENGINE_VERSION, sorted(fields.items(), key=lambda item: item[0])))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def subject_hashes(df_baseline):
+    if df_baseline.index.has_duplicates:
+        raise ValueError('Incremental mode needs one baseline row per included subject')
+    return pd.util.hash_pandas_object(df_baseline, index=True).rename('hash')
+
+
+# Previous subject hashes and the columns they cover, with the cached records only when the
+# spec and engine are unchanged
+def load_state(state_dir, key):
+    state_path = os.path.join(state_dir, 'state.json')
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as f:
+        state = json.load(f)
+
+    state['hashes'] = pd.read_parquet(os.path.join(state_dir, 'hashes.parquet'))['hash']
+    state['columns'] = state.get('columns', [])
+    state['reusable'] = state['fingerprint'] == key
+    if state['reusable']:
+        for name in RECORDS:
+            state[name] = pd.read_parquet(os.path.join(state_dir, f'{name}.parquet'))
+    return state
+
+
+def save_state(state_dir, key, hashes, columns, records, icv_coefficients):
+    os.makedirs(state_dir, exist_ok=True)
+    hashes.to_frame().to_parquet(os.path.join(state_dir, 'hashes.parquet'))
+    for name, df in zip(RECORDS, records):
+        df.to_parquet(os.path.join(state_dir, f'{name}.parquet'))
+    with open(os.path.join(state_dir, 'state.json'), 'w') as f:
+        json.dump({'fingerprint': key, 'columns': list(columns), 'icv_coefficients': icv_coefficients}, f, indent=1)
+
+
+# Status of every subject compared with the previous run over the columns hashed last time,
+# every subject still present being changed if one of those columns is gone. Subjects with
+# values in columns new to this freeze are returned apart, to be checked on their records
+def compare_subjects(df_baseline, hashes, previous):
+    previous_hashes = previous['hashes'] if previous is not None else pd.Series(dtype='uint64')
+    columns = previous['columns'] if previous is not None else list(df_baseline.columns)
+    status = pd.Series('unchanged', index=hashes.index, name='status')
+    status[~hashes.index.isin(previous_hashes.index)] = 'added'
+    common = hashes.index.intersection(previous_hashes.index)
+    recheck = common[:0]
+    if set(columns) <= set(df_baseline.columns):
+        compared = hashes if list(df_baseline.columns) == columns else subject_hashes(df_baseline[columns])
+        moved = compared[common].to_numpy() != previous_hashes[common].to_numpy()
+        status[common[moved]] = 'changed'
+        new_columns = [col for col in df_baseline.columns if col not in columns]
+        if new_columns:
+            recheck = common[~moved & df_baseline.loc[common, new_columns].notna().any(axis=1).to_numpy()]
+    else:
+        status[common] = 'changed'
+    removed = pd.Series('removed', index=previous_hashes.index.difference(hashes.index), name='status')
+    df_changes = pd.concat([status, removed]).to_frame()
+    df_changes.index.name = 'ID'
+    return df_changes, recheck
+
+
+# Hash of each record row, with a single NaN since computed NaN can differ in their bits
+def record_hashes(df):
+    df = df.apply(lambda col: col.where(col.notna()) if pd.api.types.is_float_dtype(col) else col)
+    return pd.util.hash_pandas_object(df, index=True).to_numpy()
+
+
+# Subjects whose derived records differ from the cached ones
+def records_moved(records, previous, ids):
+    moved = np.zeros(len(ids), dtype=bool)
+    for name, df in zip(RECORDS, records):
+        moved |= record_hashes(df.loc[ids]) != record_hashes(previous[name].loc[ids])
+    return ids[moved]
+
+
+def update_incremental(spec, df_baseline, derive_records, fit_structural, profiler=None):
+    profiler = profiler or Profiler()
+    with profiler.stage('incremental update') as stage:
+        state_dir = os.path.join(spec.output_dir, STATE_DIR)
+        key = fingerprint(spec)
+        hashes = subject_hashes(df_baseline)
+        previous = load_state(state_dir, key)
+        df_changes, recheck = compare_subjects(df_baseline, hashes, previous)
+        stale = hashes.index[df_changes.loc[hashes.index, 'status'].isin(['added', 'changed']).to_numpy()
+                             | hashes.index.isin(recheck)]
+
+        # Records cached under other cohort settings are derived again for everyone
+        if previous is not None and not previous['reusable']:
+            previous = None
+            stale = hashes.index
+
+    # Derive records only for new and changed subjects and reuse the rest from the cache
+    derived = derive_records(spec, df_baseline.loc[stale], profiler)
+    volumes = derived[1]
+    with profiler.stage('incremental merge') as stage:
+        records = []
+        for name, df_new in zip(RECORDS, (derived[0], derived[2], derived[3])):
+            if previous is None:
+                records.append(stage.record(df_new, name))
+                continue
+            df_old = previous[name]
+            df_old = df_old[df_old.index.isin(hashes.index) & ~df_old.index.isin(stale)]
+            records.append(stage.record(pd.concat([df_old, df_new]).loc[hashes.index], name))
+
+        # Subjects with values in new columns are only changed if these reach their records
+        if previous is not None and len(recheck):
+            df_changes.loc[records_moved(records, previous, recheck), 'status'] = 'changed'
+        stage.record(df_changes, 'changes')
+        moved = df_changes.index[df_changes['status'].isin(['added', 'changed'])]
+
+        # Refit the ICV adjustment only if a subject in its reference set was added, changed or removed
+        df_bilateral = records[0]
+        reference_moved = previous is None
+        if previous is not None:
+            old_reference = previous['bilateral'].index[previous['bilateral']['icv_reference'].to_numpy(dtype=bool)]
+            new_reference = df_bilateral.index[df_bilateral['icv_reference'].to_numpy(dtype=bool)]
+            reference_moved = (not old_reference.sort_values().equals(new_reference.sort_values())
+                               or np.isin(new_reference, moved).any())
+        if reference_moved:
+            icv_coefficients = fit_structural(spec, df_bilateral, volumes)
+        else:
+            icv_coefficients = previous['icv_coefficients']
+
+        save_state(state_dir, key, hashes, df_baseline.columns, records, icv_coefficients)
+    return records[0], volumes, records[1], records[2], icv_coefficients, df_changes
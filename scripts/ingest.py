@@ -0,0 +1,116 @@
+# Columnar ingest cache for the wide cohort CSVs. Each source file is converted once
+# to Parquet (or Feather) keyed on its content hash so that re-runs skip CSV parsing
+# and only read the columns a stage asks for
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from schema import apply_schema
+
+try:
+    import pyarrow.dataset as dataset
+    import pyarrow.feather as feather
+    import pyarrow.parquet as parquet
+except ImportError:
+    dataset = feather = parquet = None
+
+CACHE_DIR = '.cache'
+FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+
+
+def file_hash(path, chunk_size=1 << 24):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Hashing a large freeze is cheap compared to parsing it, but still reads every byte.
+# Remember the hash of each source together with its size and modification time
+def cached_hash(path, cache_dir):
+    index_path = os.path.join(cache_dir, 'index.json')
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['hash']
+
+    index[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(path)}
+    tmp_path = f'{index_path}.{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, index_path)
+    return index[key]['hash']
+
+
+def read_source(path, **kwargs):
+    # Index column written by R/pandas when saving the freezes is never used
+    return pd.read_csv(path, usecols=lambda x: x != 'Unnamed: 0', low_memory=False, **kwargs)
+
+
+# Convert a source CSV to the columnar cache if it is not already there
+def ensure_cached(path, cache_dir=None, fmt='parquet'):
+    cache_dir = cache_dir or os.path.join(os.path.dirname(path), CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f'{stem}_{cached_hash(path, cache_dir)[:16]}{FORMATS[fmt]}')
+    if os.path.exists(cache_path):
+        return cache_path
+
+    df = read_source(path)
+    tmp_path = f'{cache_path}.{os.getpid()}'
+    if fmt == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_feather(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def cached_columns(cache_path):
+    if cache_path.endswith(FORMATS['parquet']):
+        return parquet.read_schema(cache_path).names
+    return feather.read_table(cache_path, memory_map=True).schema.names
+
+
+# Read a cohort file projected onto the requested columns and typed with the cohort
+# schema. Columns can be a list of names or a predicate on the column name and are
+# returned in file order. Rows are optional positions in the file, so only participants
+# that passed earlier filters are materialized
+def read_table(path, columns=None, index_col=None, rows=None, cache=True, memory_map=False, fmt='parquet',
+               cache_dir=None, schema=None):
+    keep = columns if columns is None or callable(columns) else set(columns).__contains__
+
+    # Without pyarrow fall back to projecting the CSV while parsing it
+    if not cache or parquet is None:
+        usecols = lambda x: x != 'Unnamed: 0' and (keep is None or x == index_col or keep(x))
+        skiprows = None
+        if rows is not None:
+            lines = set(np.asarray(rows) + 1)
+            skiprows = lambda i: i > 0 and i not in lines
+        df = pd.read_csv(path, usecols=usecols, index_col=index_col, skiprows=skiprows, low_memory=False)
+        return apply_schema(df, schema)
+
+    cache_path = ensure_cached(path, cache_dir, fmt)
+    names = [name for name in cached_columns(cache_path) if keep is None or name == index_col or keep(name)]
+    if fmt == 'parquet' and rows is not None:
+        table = dataset.dataset(cache_path, format='parquet').take(np.asarray(rows), columns=names)
+    elif fmt == 'parquet':
+        table = parquet.read_table(cache_path, columns=names, memory_map=memory_map)
+    else:
+        table = feather.read_table(cache_path, columns=names, memory_map=memory_map)
+        if rows is not None:
+            table = table.take(np.asarray(rows))
+    df = table.to_pandas()
+    if index_col is not None:
+        df = df.set_index(index_col)
+    return apply_schema(df, schema)
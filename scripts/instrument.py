@@ -0,0 +1,105 @@
+# Stage-level instrumentation of the preprocessing engine. Each stage records its wall
+# time, peak resident memory, the memory of the frames it produced and their shape, and
+# the report is saved as JSON with a human-readable summary next to it
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+MB = 1024 ** 2
+
+
+# Current and peak resident memory in bytes. On Linux the peak can be reset before each
+# stage through /proc so that it measures the stage alone; elsewhere it is the process peak
+def read_rss():
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024
+        return None, peak
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def frame_memory(df):
+    return int(df.memory_usage(deep=True).sum()) if isinstance(df, pd.DataFrame) else int(df.memory_usage(deep=True))
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.frames = {}
+
+    # Register a frame produced by the stage
+    def record(self, df, label=None):
+        self.frames[label or f'frame{len(self.frames)}'] = {
+            'rows': int(df.shape[0]),
+            'columns': int(df.shape[1]) if df.ndim > 1 else 1,
+            'memory_mb': round(frame_memory(df) / MB, 3),
+        }
+        return df
+
+
+class Profiler:
+    def __init__(self, name=None):
+        self.name = name
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        stage = Stage(name)
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            seconds = time.perf_counter() - start
+            rss, peak = read_rss()
+            self.stages.append({
+                'stage': name,
+                'seconds': round(seconds, 4),
+                'peak_rss_mb': round(peak / MB, 1),
+                'rss_mb': round(rss / MB, 1) if rss is not None else None,
+                'frames': stage.frames,
+            })
+
+    def report(self, **extra):
+        return {'name': self.name, 'total_seconds': round(sum(s['seconds'] for s in self.stages), 4),
+                'stages': self.stages, **extra}
+
+
+def summary(report):
+    lines = [f'{report["name"]}: {report["total_seconds"]:.2f} s']
+    lines.append(f'  {"stage":<22}{"time (s)":>10}{"peak RSS (MB)":>15}{"rows":>10}{"cols":>7}{"frames (MB)":>13}')
+    for stage in report['stages']:
+        frames = stage['frames'].values()
+        rows = max((f['rows'] for f in frames), default='')
+        cols = sum(f['columns'] for f in frames) if frames else ''
+        memory = f'{sum(f["memory_mb"] for f in frames):.2f}' if frames else ''
+        lines.append(f'  {stage["stage"]:<22}{stage["seconds"]:>10.3f}{stage["peak_rss_mb"]:>15.1f}'
+                     f'{rows:>10}{cols:>7}{memory:>13}')
+    if report.get('funnel'):
+        lines.append('  inclusion funnel')
+        for step in report['funnel']:
+            lines.append(f'    {step["step"]:<28}{step["before"]:>8} -{step["removed"]:<7}{step["remaining"]:>8}')
+    return '\n'.join(lines)
+
+
+def save_report(report, output_dir, name='preprocess_report'):
+    with open(os.path.join(output_dir, f'{name}.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(output_dir, f'{name}.txt'), 'w') as f:
+        f.write(summary(report) + '\n')
@@ -0,0 +1,145 @@
+# Per-subject summary of the long format visits used by the inclusion funnel.
+# Counts of valid PACC visits, first and last valid visit and maximum follow-up are
+# computed with vectorized groupby reductions, either on a loaded frame or streaming
+# over chunks of a long file that does not fit in memory. Per-subject OLS slopes of PACC
+# over time are computed from segmented sums over the ID-sorted visits
+import argparse
+
+import numpy as np
+import pandas as pd
+
+SUMMARY_COLS = ['nTimePoints', 'first_visit', 'last_visit', 'max_months']
+SLOPE_SUMS = {'n': 'sum', 't': 'sum', 'y': 'sum', 'tt': 'sum', 'ty': 'sum', 'yy': 'sum', 't_min': 'min', 't_max': 'max'}
+
+
+# Partial summary of a set of visits. Reductions are all associative so partials of
+# separate chunks can be combined afterwards without sorting the visits
+def summarize_visits(df_long):
+    months = df_long['MonthsFromBaseline_raw']
+    valid_months = months.where(df_long['zPACC'].notna())
+    df = pd.DataFrame({'zPACC': df_long['zPACC'], 'valid_months': valid_months, 'months': months},
+                      index=df_long.index)
+    return df.groupby(level='ID', sort=False).agg(
+        nTimePoints=('zPACC', 'count'),
+        first_visit=('valid_months', 'min'),
+        last_visit=('valid_months', 'max'),
+        max_months=('months', 'max'),
+    )
+
+
+def combine_summaries(partials):
+    df = pd.concat(partials)
+    if not df.index.has_duplicates:
+        return df
+    return df.groupby(level='ID', sort=False).agg(
+        nTimePoints=('nTimePoints', 'sum'),
+        first_visit=('first_visit', 'min'),
+        last_visit=('last_visit', 'max'),
+        max_months=('max_months', 'max'),
+    )
+
+
+# Follow-up time in years from baseline to the last visit of each subject
+def finalize_summary(df_summary):
+    df_summary = df_summary[SUMMARY_COLS].copy()
+    df_summary['follow_up_time'] = df_summary['max_months']/12
+    return df_summary
+
+
+def visit_summary(df_long):
+    return finalize_summary(summarize_visits(df_long))
+
+
+def stream_visit_summary(path, chunksize=1_000_000):
+    # Only the three columns needed are parsed and each chunk is reduced before the next is read
+    reader = pd.read_csv(path, usecols=['ID', 'zPACC', 'MonthsFromBaseline_raw'], index_col='ID',
+                         chunksize=chunksize)
+    partials = []
+    for chunk in reader:
+        partials.append(summarize_visits(chunk))
+        # Keep memory bounded by the number of subjects rather than the number of chunks
+        if len(partials) > 8:
+            partials = [combine_summaries(partials)]
+    if not partials:
+        return finalize_summary(pd.DataFrame(columns=SUMMARY_COLS, index=pd.Index([], name='ID')))
+    return finalize_summary(combine_summaries(partials))
+
+
+# Sums of time in years, PACC and their products over the valid visits of each subject.
+# Visits are grouped by sorting the subject codes once and reducing contiguous segments
+def slope_sums(df_long):
+    valid = (df_long['zPACC'].notna() & df_long['MonthsFromBaseline_raw'].notna()).to_numpy()
+    codes, subjects = pd.factorize(df_long.index[valid])
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    t = df_long['MonthsFromBaseline_raw'].to_numpy(dtype=float)[valid][order] / 12
+    y = df_long['zPACC'].to_numpy(dtype=float)[valid][order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=int)
+
+    sums = {'n': np.diff(np.r_[starts, len(codes)])}
+    for name, values in (('t', t), ('y', y), ('tt', t * t), ('ty', t * y), ('yy', y * y)):
+        sums[name] = np.add.reduceat(values, starts) if len(codes) else values
+    sums['t_min'] = np.minimum.reduceat(t, starts) if len(codes) else t
+    sums['t_max'] = np.maximum.reduceat(t, starts) if len(codes) else t
+    return pd.DataFrame(sums, index=pd.Index(subjects[codes[starts]], name='ID'))
+
+
+def combine_slope_sums(partials):
+    df = pd.concat(partials)
+    if not df.index.has_duplicates:
+        return df
+    return df.groupby(level='ID', sort=False).agg(SLOPE_SUMS)
+
+
+# OLS intercept at baseline, slope per year, residual variance and standard error of the
+# slope of each subject, with the span of their visits and the mean interval between them
+def finalize_slopes(df_sums):
+    n = df_sums['n'].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_mean = df_sums['t'].to_numpy() / n
+        y_mean = df_sums['y'].to_numpy() / n
+        stt = df_sums['tt'].to_numpy() - n * t_mean ** 2
+        sty = df_sums['ty'].to_numpy() - n * t_mean * y_mean
+        syy = df_sums['yy'].to_numpy() - n * y_mean ** 2
+        slope = np.where((n > 1) & (stt > 0), sty / stt, np.nan)
+        residual_var = np.where(n > 2, np.maximum(syy - slope * sty, 0) / (n - 2), np.nan)
+        span = df_sums['t_max'].to_numpy() - df_sums['t_min'].to_numpy()
+        return pd.DataFrame({
+            'pacc_n_visits': n.astype(int),
+            'pacc_intercept': y_mean - slope * t_mean,
+            'pacc_slope': slope,
+            'pacc_slope_se': np.sqrt(residual_var / stt),
+            'pacc_residual_var': residual_var,
+            'pacc_span_years': span,
+            'pacc_mean_interval': np.where(n > 1, span / (n - 1), np.nan),
+        }, index=df_sums.index)
+
+
+def pacc_slopes(df_long):
+    return finalize_slopes(slope_sums(df_long))
+
+
+def stream_pacc_slopes(path, chunksize=1_000_000):
+    reader = pd.read_csv(path, usecols=['ID', 'zPACC', 'MonthsFromBaseline_raw'], index_col='ID',
+                         chunksize=chunksize)
+    partials = []
+    for chunk in reader:
+        partials.append(slope_sums(chunk))
+        if len(partials) > 8:
+            partials = [combine_slope_sums(partials)]
+    if not partials:
+        return finalize_slopes(pd.DataFrame(columns=list(SLOPE_SUMS), index=pd.Index([], name='ID')))
+    return finalize_slopes(combine_slope_sums(partials))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reduce a long format file to one row per subject')
+    parser.add_argument('long_path', help='Long format csv with ID, zPACC and MonthsFromBaseline_raw')
+    parser.add_argument('output', help='Where to save the per-subject summary')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='Rows of the long file read at a time')
+    parser.add_argument('--slopes', action='store_true', help='Save per-subject OLS PACC slopes instead')
+    args = parser.parse_args()
+    if args.slopes:
+        stream_pacc_slopes(args.long_path, args.chunksize).to_csv(args.output)
+    else:
+        stream_visit_summary(args.long_path, args.chunksize).to_csv(args.output)
@@ -0,0 +1,207 @@
+# Random-effects meta-analysis of the BrainAge associations across cohorts. Per-cohort
+# estimates and standard errors are stacked as outcomes x cohorts x replicates and every
+# pooled fit (DerSimonian-Laird, ML and REML, with leave-one-cohort-out and bootstrap
+# replicates) is computed in one batched call along the cohort axis
+import argparse
+import math
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Cohort and diagnosis of each study of the forest plots
+STUDIES = {
+    'a4': ('a4', None),
+    'habs': ('habs', None),
+    'adni_cu': ('adni', 'CN'),
+    'adni_mci': ('adni', 'MCI'),
+}
+OUTCOMES = ('PACC_mri', 'ab_composite', 'ptau', 'tau_composite')
+
+
+def load_study(spec, diagnosis=None):
+    df = pd.read_csv(os.path.join(spec.output_dir, 'baseline.csv'), index_col='ID')
+    deltas = pd.read_csv(os.path.join(spec.output_dir, 'brainage', 'predicted_age.csv'), index_col='ID')
+    df = df.join(deltas['delta_all'].rename('delta'), how='inner')
+    if diagnosis is not None:
+        df = df[df['diagnosis'] == diagnosis]
+    return df
+
+
+# Standardized slope of each outcome on the predictor and its standard error in each study.
+# Replicate 0 is the study itself and the others resample its participants with replacement
+def study_estimates(frames, outcomes=OUTCOMES, predictor='delta', n_bootstrap=0, seed=0):
+    rng = np.random.default_rng(seed)
+    estimates = np.full((len(outcomes), len(frames), n_bootstrap + 1), np.nan)
+    errors = np.full_like(estimates, np.nan)
+    for j, df in enumerate(frames):
+        n = len(df)
+        weights = np.ones((1, n))
+        if n_bootstrap:
+            weights = np.vstack([weights, rng.multinomial(n, np.full(n, 1 / n), size=n_bootstrap)])
+        for i, outcome in enumerate(outcomes):
+            valid = (df[outcome].notna() & df[predictor].notna()).to_numpy()
+            if valid.sum() < 3:
+                continue
+            x = df[predictor].to_numpy(dtype=float)[valid]
+            y = df[outcome].to_numpy(dtype=float)[valid]
+            x = (x - x.mean()) / x.std(ddof=1)
+            y = (y - y.mean()) / y.std(ddof=1)
+
+            # Weighted least squares of every replicate from its weighted sums
+            w = weights[:, valid]
+            n_w = w.sum(axis=1)
+            x_mean = (w @ x) / n_w
+            y_mean = (w @ y) / n_w
+            sxx = w @ (x * x) - n_w * x_mean ** 2
+            sxy = w @ (x * y) - n_w * x_mean * y_mean
+            syy = w @ (y * y) - n_w * y_mean ** 2
+            with np.errstate(invalid='ignore', divide='ignore'):
+                slope = sxy / sxx
+                residual_var = np.maximum(syy - slope * sxy, 0) / (n_w - 2)
+                estimates[i, j] = slope
+                errors[i, j] = np.sqrt(residual_var / sxx)
+    return estimates, errors
+
+
+# Weighted mean, its variance and the heterogeneity statistics of the studies along the last
+# axis. Missing studies (NaN) get zero weight
+def weighted_pool(y, v, tau2):
+    valid = ~(np.isnan(y) | np.isnan(v))
+    w = np.where(valid, 1 / (np.where(valid, v, 1) + tau2[..., None]), 0)
+    y = np.where(valid, y, 0)
+    w_sum = w.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = (w * y).sum(axis=-1) / w_sum
+    return mu, w, w_sum, valid
+
+
+# Between-study variance is zero when fewer than two studies are left
+def tau2_dl(y, v):
+    mu, w, w_sum, valid = weighted_pool(y, v, np.zeros(y.shape[:-1]))
+    k = valid.sum(axis=-1)
+    q = (w * (np.where(valid, y, 0) - mu[..., None]) ** 2).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c = w_sum - (w ** 2).sum(axis=-1) / w_sum
+        return np.where(k > 1, np.maximum((q - (k - 1)) / c, 0), 0)
+
+
+# ML and REML estimates by fixed-point iteration from the DerSimonian-Laird estimate
+def tau2_likelihood(y, v, reml=True, max_iter=200, tol=1e-10):
+    tau2 = tau2_dl(y, v)
+    single = (~(np.isnan(y) | np.isnan(v))).sum(axis=-1) < 2
+    for _ in range(max_iter):
+        mu, w, w_sum, valid = weighted_pool(y, v, tau2)
+        residual = np.where(valid, y, 0) - mu[..., None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            update = (w ** 2 * (residual ** 2 - np.where(valid, v, 0))).sum(axis=-1) / (w ** 2).sum(axis=-1)
+            if reml:
+                update = update + 1 / w_sum
+        update = np.where(single, 0, np.maximum(update, 0))
+        converged = np.nanmax(np.abs(update - tau2), initial=0) < tol
+        tau2 = update
+        if converged:
+            break
+    return tau2
+
+
+def random_effects(y, se, method='REML', level=0.95, knha=False):
+    v = se ** 2
+    if method == 'DL':
+        tau2 = tau2_dl(y, v)
+    elif method in ('ML', 'REML'):
+        tau2 = tau2_likelihood(y, v, reml=method == 'REML')
+    else:
+        raise ValueError(f'Unknown method {method}')
+
+    # Cochran's Q and I2 with the typical within-study variance of Higgins and Thompson
+    _, w_fixed, w_fixed_sum, valid = weighted_pool(y, v, np.zeros(y.shape[:-1]))
+    k = valid.sum(axis=-1)
+    mu, w, w_sum, _ = weighted_pool(y, v, tau2)
+    residual = np.where(valid, y, 0) - mu[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu_fixed = (w_fixed * np.where(valid, y, 0)).sum(axis=-1) / w_fixed_sum
+        q = (w_fixed * (np.where(valid, y, 0) - mu_fixed[..., None]) ** 2).sum(axis=-1)
+        typical_v = (k - 1) * w_fixed_sum / (w_fixed_sum ** 2 - (w_fixed ** 2).sum(axis=-1))
+        i2 = 100 * tau2 / (tau2 + typical_v)
+        se_mu = np.sqrt(1 / w_sum)
+        if knha:
+            # Knapp-Hartung needs two studies, a single one keeps its own standard error
+            from scipy.stats import t as t_dist
+            multiple = k > 1
+            se_mu = np.where(multiple, np.sqrt((w * residual ** 2).sum(axis=-1) / ((k - 1) * w_sum)), se_mu)
+            dof = np.maximum(k - 1, 1)
+            crit = np.where(multiple, t_dist.ppf((1 + level) / 2, dof), NormalDist().inv_cdf((1 + level) / 2))
+            p = np.where(multiple, 2 * t_dist.sf(np.abs(mu / se_mu), dof),
+                         np.frompyfunc(math.erfc, 1, 1)(np.abs(mu / se_mu) / math.sqrt(2)).astype(float))
+        else:
+            crit = NormalDist().inv_cdf((1 + level) / 2)
+            p = np.frompyfunc(math.erfc, 1, 1)(np.abs(mu / se_mu) / math.sqrt(2)).astype(float)
+    return {'estimate': mu, 'se': se_mu, 'ci_lower': mu - crit * se_mu, 'ci_upper': mu + crit * se_mu,
+            'p': p, 'tau2': tau2, 'i2': np.where(k > 1, i2, np.nan), 'q': q, 'k': k}
+
+
+# Pooled fits of every method over all cohorts and leaving each one out in turn. Cohorts are
+# along `axis` of the stacked estimates and are replaced by a leading (none, left out) axis
+def meta_analysis(estimates, errors, methods=('DL', 'REML'), axis=1, leave_one_out=True, level=0.95, knha=False):
+    y = np.moveaxis(estimates, axis, -1)
+    se = np.moveaxis(errors, axis, -1)
+    k = y.shape[-1]
+    if leave_one_out:
+        keep = np.vstack([np.ones(k, dtype=bool), ~np.eye(k, dtype=bool)])
+        y = np.where(keep, y[..., None, :], np.nan)
+        se = np.where(keep, se[..., None, :], np.nan)
+    else:
+        y, se = y[..., None, :], se[..., None, :]
+    return {method: {name: np.moveaxis(values, -1, 0)
+                     for name, values in random_effects(y, se, method, level, knha).items()}
+            for method in methods}
+
+
+# One row per outcome, method and left out study with the bootstrap interval of the estimate
+def results_table(results, outcomes, studies, level=0.95):
+    rows = []
+    tails = 100 * np.array([(1 - level) / 2, (1 + level) / 2])
+    for method, values in results.items():
+        for m, left_out in enumerate([None, *studies][:values['estimate'].shape[0]]):
+            for i, outcome in enumerate(outcomes):
+                row = {'outcome': outcome, 'method': method, 'left_out': left_out}
+                row.update({name: array[m, i, 0] for name, array in values.items()})
+                replicates = values['estimate'][m, i, 1:]
+                if len(replicates):
+                    row['boot_ci_lower'], row['boot_ci_upper'] = np.nanpercentile(replicates, tails)
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    from cohorts import COHORTS
+
+    parser = argparse.ArgumentParser(description='Pool the BrainAge associations of the cohorts')
+    parser.add_argument('studies', nargs='*', metavar='STUDY', help=f'Among {", ".join(STUDIES)} (default: all)')
+    parser.add_argument('--data-root', default=None, help='Root folder with the cohort data')
+    parser.add_argument('--outcome', action='append', default=None, help='Outcomes to regress on delta')
+    parser.add_argument('--method', action='append', default=None, choices=['DL', 'ML', 'REML'])
+    parser.add_argument('--bootstrap', type=int, default=0, help='Bootstrap replicates of every study')
+    parser.add_argument('--no-leave-one-out', dest='leave_one_out', action='store_false')
+    parser.add_argument('--knha', action='store_true', help='Knapp-Hartung intervals (needs scipy)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='results/meta_analysis.csv', help='Where to save the pooled fits')
+    args = parser.parse_args()
+    unknown = set(args.studies) - set(STUDIES)
+    if unknown:
+        raise SystemExit(f'Unknown studies: {", ".join(sorted(unknown))}')
+
+    studies = args.studies or list(STUDIES)
+    outcomes = args.outcome or list(OUTCOMES)
+    frames = []
+    for name in studies:
+        cohort, diagnosis = STUDIES[name]
+        spec = COHORTS[cohort] if args.data_root is None else COHORTS[cohort].with_data_root(args.data_root)
+        frames.append(load_study(spec, diagnosis))
+    estimates, errors = study_estimates(frames, outcomes, n_bootstrap=args.bootstrap, seed=args.seed)
+    results = meta_analysis(estimates, errors, args.method or ('DL', 'REML'), leave_one_out=args.leave_one_out,
+                            knha=args.knha)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    results_table(results, outcomes, studies).to_csv(args.output, index=False)
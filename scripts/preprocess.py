@@ -0,0 +1,303 @@
+# Preprocessing engine shared by every cohort. Each cohort is described by a
+# CohortSpec in cohorts.py and all requested cohorts run concurrently in a process pool
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from brainage import brainage_cohort
+from cohorts import COHORTS
+from features import combine_bilateral
+from funnel import inclusion_plan
+from icv import apply_icv, fit_icv, save_coefficients
+from incremental import update_incremental
+from ingest import read_table
+from instrument import Profiler, save_report, summary
+from longitudinal import pacc_slopes, stream_pacc_slopes, stream_visit_summary, visit_summary
+from tau import region_index, tau_composites
+
+
+def load_data(spec, profiler, cache=True, memory_map=False, fmt='parquet', long_chunksize=None, slopes=False):
+    # Only the key columns of the baseline are read before the inclusion funnel
+    with profiler.stage('load') as stage:
+        df_keys = read_table(spec.baseline_path, columns=spec.key_columns,
+                             cache=cache, memory_map=memory_map, fmt=fmt, schema=spec.schema)
+        df_keys = stage.record(df_keys.rename(columns={spec.baseline_id: 'ID'}), 'keys')
+        df_long = None
+        if not long_chunksize:
+            df_long = stage.record(read_table(spec.long_path, columns=spec.long_columns, index_col='ID',
+                                              cache=cache, memory_map=memory_map, fmt=fmt), 'long')
+
+    # The long format data is reduced to one row per subject, streaming over chunks if requested
+    with profiler.stage('longitudinal filter') as stage:
+        df_slopes = None
+        if df_long is None:
+            df_visits = stream_visit_summary(spec.long_path, long_chunksize)
+            if slopes:
+                df_slopes = stream_pacc_slopes(spec.long_path, long_chunksize)
+        else:
+            df_visits = visit_summary(df_long)
+            if slopes:
+                df_slopes = pacc_slopes(df_long)
+        stage.record(df_visits, 'visits')
+        if slopes:
+            stage.record(df_slopes, 'slopes')
+    return df_keys, df_visits, df_slopes
+
+
+def select_participants(spec, df_keys, df_visits):
+    # Position of each participant in the baseline file to read their wide columns later
+    df_keys['row'] = np.arange(len(df_keys))
+    df_keys = df_keys.join(df_visits[['nTimePoints', 'follow_up_time']], on='ID')
+    return inclusion_plan(spec).execute(df_keys)
+
+
+def load_baseline(spec, df_included, cache=True, memory_map=False, fmt='parquet'):
+    # Wide columns of the participants that passed the inclusion funnel
+    df_baseline = read_table(spec.baseline_path, columns=spec.uses_baseline_column, index_col=spec.baseline_id,
+                             rows=df_included['row'], cache=cache, memory_map=memory_map, fmt=fmt,
+                             schema=spec.schema)
+
+    # Rename index column to ID
+    df_baseline.index.name = 'ID'
+    df_baseline['follow_up_time'] = df_included['follow_up_time'].to_numpy()
+    return df_baseline
+
+
+def build_bilateral(spec, df_baseline):
+    # Process MRI features for BrainAge modelling by keeping only columns that start with MRI_
+    df_structural = df_baseline.filter(like='MRI_')
+    df_structural.columns = df_structural.columns.str.replace('MRI_FS7_rnr_', '')
+
+    # Combine lh and rh cortical thickness and Left and Right subcortical volumes
+    df_structural, volumes = combine_bilateral(df_structural, spec.full_region_names)
+
+    # Keep MRI_Age, ICV and bi_ columns and whether each subject is in the ICV reference set
+    df_structural = df_structural[['MRI_Age', 'ICV_vol'] + [col for col in df_structural.columns if 'bi_' in col]]
+    if spec.icv_reference is None:
+        df_structural['icv_reference'] = True
+    else:
+        df_structural['icv_reference'] = (df_baseline['Diagnosis'] == spec.icv_reference).to_numpy()
+    return df_structural, volumes
+
+
+# Rename MRI_Age to age and lower case column names, as in structural_features.csv
+def structural_names(df_bilateral):
+    df_bilateral = df_bilateral.rename(columns={'MRI_Age': 'age'})
+    df_bilateral.columns = df_bilateral.columns.str.lower()
+    return df_bilateral
+
+
+# Normalize volumes by total intracranial volume with respect to the reference set. The
+# coefficients are keyed on the written column names so that new scans can be adjusted
+def fit_structural(spec, df_bilateral, volumes):
+    df_bilateral = structural_names(df_bilateral)
+    icv_coefficients = fit_icv(df_bilateral, [col.lower() for col in volumes], df_bilateral['icv_reference'],
+                               icv_col='icv_vol')
+    icv_coefficients['reference'] = spec.icv_reference or 'all'
+    return icv_coefficients
+
+
+def normalize_structural(df_bilateral, icv_coefficients):
+    df_structural = apply_icv(structural_names(df_bilateral), icv_coefficients)
+
+    # Keep only age and bi_ columns
+    return df_structural[['age'] + [col for col in df_structural.columns if 'bi_' in col]]
+
+
+def build_clinical(spec, df_baseline):
+    e4 = df_baseline['e4_carrier']
+    ab = df_baseline[spec.ab_group_col]
+    df_clinical = pd.DataFrame(index=df_baseline.index)
+
+    # Create clinical file with CN being e4- and ab-
+    cn = (e4 == 0) & (ab == spec.ab_negative)
+    if spec.cn_requires_diagnosis:
+        cn &= df_baseline['Diagnosis'] == 'CN'
+    df_clinical[spec.cn_label] = cn.astype(int)
+
+    if spec.clinical_groups == 'cn_vs_rest':
+        df_clinical['not_cn'] = 1 - df_clinical[spec.cn_label]
+    else:
+        df_clinical['e4+'] = ((e4 == 1) & (ab == spec.ab_negative)).astype(int)
+        df_clinical['e4+ab+'] = ((e4 == 1) & (ab == spec.ab_positive)).astype(int)
+        df_clinical['ab+'] = ((e4 == 0) & (ab == spec.ab_positive)).astype(int)
+        df_clinical['unknown'] = (e4.isna() | ab.isna()).astype(int)
+    return df_clinical
+
+
+def derive_time_diffs(spec, df_baseline):
+    # Date of each point of measurment were parsed when reading. They were already pulled to be
+    # closest in time to first known MRI
+    # Time differences in years between each measure and the MRI, attached to the wide frame at once
+    time_diffs = {}
+    for measure, col in spec.time_sources.items():
+        diff = df_baseline[col] - df_baseline[spec.mri_time]
+        if spec.time_unit == 'months':
+            time_diffs['time_diff_' + measure] = diff/12
+        else:
+            time_diffs['time_diff_' + measure] = diff.dt.days/365.25
+    return pd.concat([df_baseline, pd.DataFrame(time_diffs, index=df_baseline.index)], axis=1)
+
+
+def harmonize_baseline(spec, df_baseline):
+    # Calculate Tau composite by averaging over regions matching the cohort patterns, NaN without any
+    tau_composite = pd.Series(np.nan, index=df_baseline.index)
+    index = region_index(df_baseline.columns, spec.tau_region) if spec.tau_region is not None else ()
+    if len(index):
+        tau_composite = tau_composites(df_baseline, index, {'tau_composite': None})['tau_composite']
+
+    # Censored ptau217 reads are already NaN from the schema. Change invalid values to NaN
+    if spec.ptau_min is not None:
+        ptau = df_baseline[spec.ptau_col]
+        df_baseline[spec.ptau_col] = ptau.mask(ptau < spec.ptau_min)
+
+    # Rename of columns of interest and keep only those needed from here on, so that new columns
+    # are added to a narrow frame
+    df_baseline = df_baseline.rename(columns=spec.rename)
+    keep = [col for col in df_baseline.columns if col in spec.output_cols or col in spec.derive_cols]
+    df_baseline = df_baseline[keep].assign(tau_composite=tau_composite)
+
+    # Convert to human redable codes and standardized codes
+    df_baseline['sex'] = df_baseline['sex'].map({1: 'Female', 0: 'Male'})
+    df_baseline['e4_carrier'] = df_baseline['e4_carrier'].map({1: 'e4+', 0: 'e4-'})
+    df_baseline['ab_status'] = df_baseline['ab_status'].map(spec.ab_status_map)
+
+    if spec.diagnosis_constant is not None:
+        df_baseline['diagnosis'] = spec.diagnosis_constant
+    if spec.derive is not None:
+        df_baseline = spec.derive(df_baseline)
+
+    # Create one new column for type of analysis: exploratory
+    # Primary includes those who have MRI measures, longitudinal PACC  and AB measures which we already filtered for
+    # Exploratory is those who also ptau AND tau_composite measures
+    df_baseline['exploratory'] = ((df_baseline['ptau'].notna()) & (df_baseline['tau_composite'].notna())).astype(int)
+
+    # Columns of interest with all the other data
+    return df_baseline[list(spec.output_cols)]
+
+
+# Per-subject records derived from the baseline rows of the included participants
+def derive_records(spec, df_baseline, profiler=None):
+    profiler = profiler or Profiler()
+    with profiler.stage('feature engineering') as stage:
+        df_bilateral, volumes = build_bilateral(spec, df_baseline)
+        df_clinical = build_clinical(spec, df_baseline)
+        stage.record(df_bilateral, 'bilateral')
+        stage.record(df_clinical, 'clinical')
+
+    with profiler.stage('time differences') as stage:
+        df_baseline = derive_time_diffs(spec, df_baseline)
+        df_baseline = stage.record(harmonize_baseline(spec, df_baseline), 'baseline')
+    return df_bilateral, volumes, df_clinical, df_baseline
+
+
+def preprocess_cohort(spec, cache=True, memory_map=False, fmt='parquet', long_chunksize=None, incremental=False,
+                      brainage=False, slopes=False):
+    profiler = Profiler(spec.name)
+    df_keys, df_visits, df_slopes = load_data(spec, profiler, cache, memory_map, fmt, long_chunksize, slopes)
+    with profiler.stage('inclusion filters') as stage:
+        df_included, df_funnel = select_participants(spec, df_keys, df_visits)
+        stage.record(df_included, 'included')
+    with profiler.stage('load baseline') as stage:
+        df_baseline = stage.record(load_baseline(spec, df_included, cache, memory_map, fmt), 'baseline')
+
+    if incremental:
+        df_bilateral, volumes, df_clinical, df_baseline, icv_coefficients, df_changes = \
+            update_incremental(spec, df_baseline, derive_records, fit_structural, profiler)
+    else:
+        df_bilateral, volumes, df_clinical, df_baseline = derive_records(spec, df_baseline, profiler)
+
+    with profiler.stage('ICV normalization') as stage:
+        if not incremental:
+            icv_coefficients = fit_structural(spec, df_bilateral, volumes)
+        df_structural = stage.record(normalize_structural(df_bilateral, icv_coefficients), 'structural')
+
+    # Save as csv
+    with profiler.stage('write'):
+        os.makedirs(spec.output_dir, exist_ok=True)
+        if incremental:
+            df_changes.to_csv(os.path.join(spec.output_dir, 'changed_ids.csv'))
+        df_structural.to_csv(os.path.join(spec.output_dir, 'structural_features.csv'))
+        df_clinical.to_csv(os.path.join(spec.output_dir, 'clinical.csv'))
+        df_baseline.to_csv(os.path.join(spec.output_dir, 'baseline.csv'))
+        df_funnel.to_csv(os.path.join(spec.output_dir, 'inclusion_funnel.csv'), index=False)
+        if slopes:
+            df_slopes.reindex(df_baseline.index).to_csv(os.path.join(spec.output_dir, 'pacc_slopes.csv'))
+        save_coefficients(icv_coefficients, os.path.join(spec.output_dir, 'icv_coefficients.json'))
+
+    # Train on the CN participants and write the BrainAge deltas of everyone
+    if brainage:
+        with profiler.stage('brainage'):
+            brainage_cohort(spec, df_structural, df_clinical[spec.cn_label].astype(bool))
+
+    # Timings, memory and participant counts of every stage
+    report = profiler.report(freeze=spec.freeze, funnel=json.loads(df_funnel.to_json(orient='records')))
+    save_report(report, spec.output_dir)
+    return spec.name, report
+
+
+def run(specs, workers=None, **options):
+    # Fork where available so children reuse the already imported pandas and pyarrow
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    workers = workers or min(len(specs), os.cpu_count() or 1)
+    process = partial(preprocess_cohort, **options)
+    if workers == 1:
+        return [process(spec) for spec in specs]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(process, specs))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Preprocess cohort freezes for BrainAge modelling')
+    parser.add_argument('cohorts', nargs='*', metavar='COHORT',
+                        help=f'Cohorts to process among {", ".join(COHORTS)} (default: all)')
+    parser.add_argument('--freeze', action='append', default=[], metavar='COHORT=DATE',
+                        help='Use a different data freeze for a cohort, e.g. adni=050125')
+    parser.add_argument('--data-root', default=None, help='Root folder with the cohort data')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='Parse the source CSVs instead of using the columnar cache')
+    parser.add_argument('--memory-map', action='store_true', help='Memory-map the cached files when reading')
+    parser.add_argument('--long-chunksize', type=int, default=None,
+                        help='Stream the long format files in chunks of this many rows')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only recompute subjects whose inputs changed since the previous run')
+    parser.add_argument('--cache-format', choices=['parquet', 'feather'], default='parquet',
+                        help='File format of the columnar cache')
+    parser.add_argument('--brainage', action='store_true',
+                        help='Train the BrainAge model on the CN participants and write their deltas')
+    parser.add_argument('--pacc-slopes', action='store_true',
+                        help='Write per-subject OLS slopes of PACC over the long format visits')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    unknown = set(args.cohorts) - set(COHORTS)
+    if unknown:
+        raise SystemExit(f'Unknown cohorts: {", ".join(sorted(unknown))}')
+    freezes = dict(item.split('=', 1) for item in args.freeze)
+    specs = []
+    for name in args.cohorts or COHORTS:
+        spec = COHORTS[name]
+        if name in freezes:
+            spec = spec.with_freeze(freezes[name])
+        if args.data_root is not None:
+            spec = spec.with_data_root(args.data_root)
+        specs.append(spec)
+    for name, report in run(specs, args.workers, cache=args.cache, memory_map=args.memory_map,
+                            fmt=args.cache_format, long_chunksize=args.long_chunksize,
+                            incremental=args.incremental, brainage=args.brainage,
+                            slopes=args.pacc_slopes):
+        print(summary(report))
+
+
+if __name__ == '__main__':
+    main()
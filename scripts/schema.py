@@ -0,0 +1,81 @@
+# Typed schema of a cohort freeze applied at read time. Dates are parsed with a declared
+# format, codes become categoricals, regional blocks are stored as float32 and censored
+# assay reads are parsed to numbers while keeping which reads were censored. Values that
+# cannot be parsed are reported instead of being silently turned into missing values
+import re
+import warnings
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Schema:
+    # Column -> date format passed to pd.to_datetime
+    dates: dict = field(default_factory=dict)
+    # Column -> allowed codes, or None to keep the codes found in the data
+    categories: dict = field(default_factory=dict)
+    # Regular expressions of columns stored as float32
+    float32: tuple = ()
+    # Column -> {censoring token: 'below' or 'above'}
+    censored: dict = field(default_factory=dict)
+    # Raise instead of warning on values that cannot be parsed
+    strict: bool = False
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def report_invalid(schema, col, invalid, index, kind):
+    if not invalid.any():
+        return
+    examples = ', '.join(map(str, index[invalid][:5]))
+    message = f'{col}: {invalid.sum()} values could not be parsed as {kind} (e.g. {examples})'
+    if schema.strict:
+        raise SchemaError(message)
+    warnings.warn(message, stacklevel=3)
+
+
+def parse_censored(schema, df, col, tokens):
+    raw = df[col]
+    text = raw.astype('string').str.strip()
+    censored = text.map(tokens, na_action='ignore')
+    values = pd.to_numeric(text.where(censored.isna()), errors='coerce')
+    report_invalid(schema, col, (raw.notna() & censored.isna() & values.isna()).to_numpy(), df.index, 'numbers')
+
+    # Censored reads are missing values with a flag of the side they were censored on
+    df[col] = values.astype('float64')
+    df[col + '_censored'] = pd.Categorical(censored, categories=sorted(set(tokens.values())))
+
+
+def apply_schema(df, schema):
+    if schema is None:
+        return df
+
+    for col, fmt in schema.dates.items():
+        if col in df:
+            raw = df[col]
+            df[col] = pd.to_datetime(raw, format=fmt, errors='coerce')
+            report_invalid(schema, col, (raw.notna() & df[col].isna()).to_numpy(), df.index, f'dates ({fmt})')
+
+    for col, codes in schema.categories.items():
+        if col in df:
+            raw = df[col]
+            if codes is None:
+                df[col] = raw.astype('category')
+                continue
+            valid = raw.isin(codes)
+            report_invalid(schema, col, (raw.notna() & ~valid).to_numpy(), df.index, f'one of {list(codes)}')
+            df[col] = pd.Categorical(raw.where(valid), categories=list(codes))
+
+    for col, tokens in schema.censored.items():
+        if col in df:
+            parse_censored(schema, df, col, tokens)
+
+    if schema.float32:
+        pattern = re.compile('|'.join(schema.float32))
+        columns = [col for col in df.columns if pattern.search(col) and pd.api.types.is_numeric_dtype(df[col])]
+        df[columns] = df[columns].astype(np.float32)
+    return df
@@ -0,0 +1,171 @@
+# Synthetic cohort freezes following the column conventions of each cohort spec, so that
+# the preprocessing engine can be benchmarked on machines without access to A4, HABS or ADNI.
+# Values are random but realistic in range and every subject is reproducible from the seed
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from cohorts import COHORTS
+from tau import DESIKAN
+
+# Name of the regional cortical and subcortical tau columns of each cohort
+TAU_FORMATS = {
+    'a4': 'PVC_{region}_bh',
+    'habs': 'TAU_HRC_FS_SUVR_PVC_{region}_bh',
+    'adni': 'PVC_CTX_{hemi}_{region}_SUVR_TAU',
+}
+TAU_SUBCORTICAL_FORMATS = {
+    'a4': 'PVC_{region}_bh',
+    'habs': 'TAU_HRC_FS_SUVR_PVC_{region}_bh',
+    'adni': 'PVC_{side}_{region}_SUVR_TAU',
+}
+SUBCORTICAL = {'Hippocampus': 4000, 'Amygdala': 1600}
+
+
+def region_names(n_rois):
+    return list(DESIKAN[:n_rois]) + [f'roi{k}' for k in range(len(DESIKAN), n_rois)]
+
+
+def with_missing(rng, values, missing):
+    values = np.asarray(values, dtype=float)
+    values[rng.random(len(values)) < missing] = np.nan
+    return values
+
+
+def random_dates(rng, n, missing, start='2005-01-01', days=5000):
+    dates = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit='D')
+    dates = np.asarray(dates.strftime('%Y-%m-%d'), dtype=object)
+    dates[rng.random(n) < missing] = None
+    return dates
+
+
+def make_baseline(spec, ids, rng, n_rois=34, missing=0.05):
+    n = len(ids)
+    columns = {spec.baseline_id: ids}
+    age = rng.uniform(55, 90, n)
+    columns['MRI_Age'] = with_missing(rng, age.round(2), missing)
+
+    # FreeSurfer cortical thickness declining with age and subcortical volumes scaling with ICV
+    regions = region_names(n_rois)
+    thickness = 2.8 - 0.01 * (age - 70)
+    for hemi in ('lh', 'rh'):
+        for region in regions:
+            columns[f'MRI_FS7_rnr_{hemi}_{region}'] = (thickness + rng.normal(0, 0.15, n)).astype(np.float32)
+    icv = rng.normal(1.5e6, 1.5e5, n)
+    for side in ('Left', 'Right'):
+        for region, volume in SUBCORTICAL.items():
+            columns[f'MRI_FS7_rnr_{side}_{region}'] = volume * icv / 1.5e6 - 20 * (age - 70) + rng.normal(0, 250, n)
+    columns['MRI_FS7_rnr_ICV_vol'] = icv
+
+    # Demographics, APOE and cognition
+    rename = {new: old for old, new in spec.rename.items()}
+    columns['Sex'] = rng.integers(0, 2, n)
+    columns['Education'] = rng.integers(8, 22, n)
+    columns['e4_carrier'] = with_missing(rng, rng.random(n) < 0.3, missing / 2)
+    columns['zPACC'] = rng.normal(0, 1, n)
+    if spec.diagnosis_filter is not None or spec.icv_reference is not None or spec.cn_requires_diagnosis:
+        columns['Diagnosis'] = rng.choice(['CN', 'CN', 'MCI'], n)
+
+    # Amyloid PET with status codes of the cohort
+    suvr = with_missing(rng, rng.lognormal(0.1, 0.2, n), missing)
+    positive = suvr > 1.25
+    columns[spec.amyloid_col] = suvr
+    status = np.where(positive, spec.ab_positive, spec.ab_negative).astype(object)
+    status[np.isnan(suvr)] = None
+    columns[spec.ab_group_col] = status
+    columns[rename['ab_composite']] = (suvr - 1) * 150
+
+    # Plasma ptau217 with censored reads and invalid negative values where the cohort has them
+    ptau = with_missing(rng, rng.lognormal(-1 + positive, 0.4), 0.3).round(4)
+    if spec.ptau_min is not None:
+        ptau[rng.random(n) < missing / 5] = -1
+    ptau = ptau.astype(object)
+    censored = spec.schema.censored.get(spec.ptau_col, {}) if spec.schema else {}
+    for token in censored:
+        ptau[rng.random(n) < missing / 2] = token
+    columns[spec.ptau_col] = ptau
+
+    # Regional tau-PET, missing for a large part of the cohort
+    has_tau = rng.random(n) > 0.5
+    tau_format = TAU_FORMATS[spec.name]
+    hemis = ('LH', 'RH') if '{hemi}' in tau_format else ('',)
+    for hemi in hemis:
+        for region in regions:
+            values = rng.lognormal(0.15 + 0.1 * positive, 0.1).astype(np.float32)
+            name = tau_format.format(hemi=hemi, region=region.upper() if hemi else region)
+            columns[name] = np.where(has_tau, values, np.nan)
+    subcortical_format = TAU_SUBCORTICAL_FORMATS[spec.name]
+    sides = ('LEFT', 'RIGHT') if '{side}' in subcortical_format else ('',)
+    for side in sides:
+        for region in SUBCORTICAL:
+            values = rng.lognormal(0.2 + 0.15 * positive, 0.1).astype(np.float32)
+            name = subcortical_format.format(side=side, region=region.upper() if side else region)
+            columns[name] = np.where(has_tau, values, np.nan)
+
+    # Time of each measure relative to the MRI, in months from baseline or as dates
+    for col in (spec.mri_time, *spec.time_sources.values()):
+        if col in columns:
+            continue
+        if spec.time_unit == 'months':
+            columns[col] = with_missing(rng, rng.integers(-6, 12, n), missing)
+        else:
+            columns[col] = random_dates(rng, n, missing)
+
+    if 'SUBSTUDY' in spec.derive_cols:
+        columns['SUBSTUDY'] = rng.choice(['A4', 'A4', 'LEARN', 'SF'], n)
+        columns['TX'] = np.where(columns['SUBSTUDY'] == 'A4', rng.choice(['Placebo', 'Solanezumab'], n), None)
+
+    df = pd.DataFrame(columns)
+    if spec.exclude_ids:
+        df.loc[:len(spec.exclude_ids) - 1, spec.baseline_id] = list(spec.exclude_ids)[:n]
+    if spec.drop_duplicate_ids:
+        df = pd.concat([df, df.sample(frac=0.005, random_state=rng.integers(1 << 31))], ignore_index=True)
+    return df
+
+
+def make_long(spec, ids, rng, max_visits=8, missing=0.1):
+    # Visits every 6 to 18 months from baseline, unsorted as in the exports
+    n_visits = rng.integers(1, max_visits + 1, len(ids))
+    subject = np.repeat(np.arange(len(ids)), n_visits)
+    starts = np.cumsum(n_visits) - n_visits
+    months = np.cumsum(rng.choice([6, 12, 18], len(subject)).astype(float))
+    months -= np.repeat(months[starts], n_visits)
+
+    df_long = pd.DataFrame({
+        'ID': np.asarray(ids, dtype=object)[subject],
+        'MonthsFromBaseline_raw': months,
+        'zPACC': with_missing(rng, rng.normal(0, 1, len(subject)) - 0.02 * months, missing),
+    })
+    if spec.long_date is not None:
+        visit = pd.Timestamp('2005-01-01') + pd.to_timedelta(rng.integers(0, 3000, len(ids)), unit='D')
+        dates = visit[subject] + pd.to_timedelta(months * 30.44, unit='D')
+        df_long[spec.long_date] = dates.strftime('%Y-%m-%d')
+    return df_long.sample(frac=1, random_state=rng.integers(1 << 31))
+
+
+# Write a synthetic baseline and long file for a cohort under data_root, as the real freezes
+def write_cohort(spec, data_root, n_subjects, n_rois=34, max_visits=8, missing=0.05, seed=0):
+    spec = spec.with_data_root(data_root)
+    rng = np.random.default_rng(seed)
+    ids = np.array([f'S{i:07d}_{spec.name}' for i in range(n_subjects)], dtype=object)
+    os.makedirs(spec.directory, exist_ok=True)
+    make_baseline(spec, ids, rng, n_rois, missing).to_csv(spec.baseline_path)
+    make_long(spec, ids, rng, max_visits, 2 * missing).to_csv(spec.long_path)
+    return spec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic cohort freezes')
+    parser.add_argument('data_root', help='Folder where <cohort>/<cohort>_baseline_<freeze>.csv are written')
+    parser.add_argument('cohorts', nargs='*', metavar='COHORT', help='Cohorts to generate (default: all)')
+    parser.add_argument('--subjects', type=int, default=1000, help='Number of subjects per cohort')
+    parser.add_argument('--rois', type=int, default=34, help='Number of cortical regions per hemisphere')
+    parser.add_argument('--visits', type=int, default=8, help='Maximum number of PACC visits per subject')
+    parser.add_argument('--missing', type=float, default=0.05, help='Fraction of missing values')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    for name in args.cohorts or COHORTS:
+        seed = args.seed + list(COHORTS).index(name)
+        write_cohort(COHORTS[name], args.data_root, args.subjects, args.rois, args.visits, args.missing, seed)
@@ -0,0 +1,172 @@
+# Tau-PET composites over a region index. The regional tau columns of each cohort are
+# mapped once onto Desikan-Killiany region names, and any number of composites are then
+# computed in a single NaN-aware matrix product over a contiguous float32 array
+import argparse
+import os
+import re
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+DESIKAN = (
+    'bankssts', 'caudalanteriorcingulate', 'caudalmiddlefrontal', 'cuneus', 'entorhinal', 'fusiform',
+    'inferiorparietal', 'inferiortemporal', 'isthmuscingulate', 'lateraloccipital', 'lateralorbitofrontal',
+    'lingual', 'medialorbitofrontal', 'middletemporal', 'parahippocampal', 'paracentral', 'parsopercularis',
+    'parsorbitalis', 'parstriangularis', 'pericalcarine', 'postcentral', 'posteriorcingulate', 'precentral',
+    'precuneus', 'rostralanteriorcingulate', 'rostralmiddlefrontal', 'superiorfrontal', 'superiorparietal',
+    'superiortemporal', 'supramarginal', 'frontalpole', 'temporalpole', 'transversetemporal', 'insula',
+)
+
+# Braak stage regions following Scholl et al. 2016 and the meta-temporal ROI of Jack et al. 2017
+COMPOSITES = {
+    'braak1': ('entorhinal',),
+    'braak2': ('hippocampus',),
+    'braak3': ('parahippocampal', 'fusiform', 'lingual', 'amygdala'),
+    'braak4': ('insula', 'inferiortemporal', 'middletemporal', 'temporalpole', 'posteriorcingulate',
+               'isthmuscingulate', 'caudalanteriorcingulate', 'rostralanteriorcingulate'),
+    'braak5': ('superiorfrontal', 'lateralorbitofrontal', 'medialorbitofrontal', 'frontalpole', 'caudalmiddlefrontal',
+               'rostralmiddlefrontal', 'parsopercularis', 'parsorbitalis', 'parstriangularis', 'lateraloccipital',
+               'supramarginal', 'inferiorparietal', 'superiortemporal', 'superiorparietal', 'precuneus', 'bankssts',
+               'transversetemporal'),
+    'braak6': ('pericalcarine', 'postcentral', 'cuneus', 'precentral', 'paracentral'),
+    'meta_temporal': ('entorhinal', 'amygdala', 'parahippocampal', 'fusiform', 'inferiortemporal', 'middletemporal'),
+    'cortex': DESIKAN,
+}
+
+
+HEMISPHERES = {'left': 'lh', 'right': 'rh'}
+
+
+@dataclass(frozen=True)
+class RegionIndex:
+    columns: tuple
+    regions: tuple
+    hemispheres: tuple
+
+    def __len__(self):
+        return len(self.columns)
+
+
+# Atlas name of a region as written by each cohort, e.g. entorhinal for CTX_LH_ENTORHINAL
+# and amygdala for Left-Amygdala
+def atlas_name(region):
+    region = re.sub(r'^(?:(?:ctx|lh|rh|left|right)[^a-z]+)+', '', region.lower())
+    return re.sub(r'[^a-z]', '', region)
+
+
+# Map the tau columns of a cohort onto atlas regions with the first pattern matching each
+# column. Patterns must have a region group and can have a hemisphere group; regions
+# without one are bilateral
+def region_index(columns, *patterns):
+    patterns = [re.compile(pattern) for pattern in patterns]
+    matched, regions, hemispheres = [], [], []
+    for col in columns:
+        match = next((m for m in (pattern.search(col) for pattern in patterns) if m is not None), None)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        hemisphere = (groups.get('hemi') or 'bh').lower()
+        matched.append(col)
+        regions.append(atlas_name(groups['region']))
+        hemispheres.append(HEMISPHERES.get(hemisphere, hemisphere))
+    return RegionIndex(tuple(matched), tuple(regions), tuple(hemispheres))
+
+
+# Region by composite membership matrix. None selects every region in the index. A composite
+# without any of its regions in the index is an error, one missing some of them a warning
+def membership(index, definitions):
+    regions = np.array(index.regions)
+    matrix = np.zeros((len(index), len(definitions)), dtype=np.float32)
+    for k, (name, members) in enumerate(definitions.items()):
+        selected = np.ones(len(index), dtype=bool) if members is None else np.isin(regions, members)
+        if not selected.any():
+            raise ValueError(f'{name}: no tau column matches its regions')
+        if members is not None:
+            missing = sorted(set(members) - set(regions))
+            if missing:
+                warnings.warn(f'{name}: regions not available in this cohort: {", ".join(missing)}', stacklevel=3)
+        matrix[selected, k] = 1
+    return matrix
+
+
+# Weight of each tau column from regional volumes mapped with another region index.
+# Bilateral tau columns are weighted by the sum of both hemispheres
+def volume_weights(df, index, volume_index):
+    weights = np.full((len(df), len(index)), np.nan, dtype=np.float32)
+    volumes = df[list(volume_index.columns)].to_numpy(dtype=np.float32)
+    vol_regions = np.array(volume_index.regions)
+    vol_hemispheres = np.array(volume_index.hemispheres)
+    for j, (region, hemisphere) in enumerate(zip(index.regions, index.hemispheres)):
+        selected = vol_regions == region
+        if hemisphere != 'bh':
+            selected &= vol_hemispheres == hemisphere
+        if selected.any():
+            weights[:, j] = volumes[:, selected].sum(axis=1)
+    return weights
+
+
+# Mean tau of every composite, skipping missing regions, optionally weighted per subject
+def tau_composites(df, index, definitions=COMPOSITES, weights=None):
+    values = np.ascontiguousarray(df[list(index.columns)].to_numpy(dtype=np.float32))
+    valid = ~np.isnan(values)
+    if weights is not None:
+        valid &= ~np.isnan(weights)
+        values = values * weights
+    else:
+        weights = np.float32(1)
+    values = np.where(valid, values, np.float32(0))
+    valid_weights = np.where(valid, weights, np.float32(0))
+
+    matrix = membership(index, definitions)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        composites = (values @ matrix) / (valid_weights @ matrix)
+    return pd.DataFrame(composites, index=df.index, columns=list(definitions))
+
+
+def parse_definitions(items):
+    definitions = dict(COMPOSITES)
+    for item in items:
+        name, regions = item.split('=', 1)
+        definitions[name] = tuple(atlas_name(region) for region in regions.split(','))
+    return definitions
+
+
+if __name__ == '__main__':
+    from cohorts import COHORTS
+    from ingest import read_table
+
+    parser = argparse.ArgumentParser(description='Compute tau-PET composites for a cohort freeze')
+    parser.add_argument('cohort', help=f'One of {", ".join(COHORTS)}')
+    parser.add_argument('--freeze', default=None, help='Data freeze to use instead of the default')
+    parser.add_argument('--data-root', default=None, help='Root folder with the cohort data')
+    parser.add_argument('--composite', action='append', default=[], metavar='NAME=REGION,REGION',
+                        help='Additional composite over atlas regions')
+    parser.add_argument('--volume-pattern', default=None,
+                        help='Regex with region (and hemi) groups of volume columns used to weight regions')
+    parser.add_argument('--all-subjects', action='store_true',
+                        help='Keep every subject instead of those in processed/baseline.csv')
+    args = parser.parse_args()
+
+    spec = COHORTS[args.cohort]
+    if args.freeze is not None:
+        spec = spec.with_freeze(args.freeze)
+    if args.data_root is not None:
+        spec = spec.with_data_root(args.data_root)
+    patterns = list(spec.tau_patterns) + ([args.volume_pattern] if args.volume_pattern else [])
+    df = read_table(spec.baseline_path, columns=lambda col: any(re.search(p, col) for p in patterns),
+                    index_col=spec.baseline_id, schema=spec.schema)
+    df.index.name = 'ID'
+    if spec.drop_duplicate_ids:
+        df = df[~df.index.duplicated(keep='first')]
+    if not args.all_subjects:
+        included = pd.read_csv(os.path.join(spec.output_dir, 'baseline.csv'), usecols=['ID'])['ID']
+        df = df[df.index.isin(included)]
+
+    index = region_index(df.columns, *spec.tau_patterns)
+    weights = None
+    if args.volume_pattern:
+        weights = volume_weights(df, index, region_index(df.columns, args.volume_pattern))
+    df_composites = tau_composites(df, index, parse_definitions(args.composite), weights)
+    df_composites.to_csv(os.path.join(spec.output_dir, 'tau_composites.csv'))